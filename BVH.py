@@ -0,0 +1,71 @@
+import time
+
+import numpy as np
+
+
+class BVH:
+    # Linear bounding volume hierarchy: triangles are sorted along a Morton curve, packed into fixed size leaves
+    # and the node boxes are stored as a complete binary tree in heap order (children of node i are 2i+1 and 2i+2).
+    def __init__(self, triangles, leaf_size=16):
+        start = time.perf_counter()
+        self.leaf_size = leaf_size
+        self.triangle_count = len(triangles)
+        self.order, self.node_min, self.node_max = self.build(np.asarray(triangles, dtype=np.float32))
+        self.leaf_count = (len(self.node_min) + 1) // 2
+        self.build_time = time.perf_counter() - start
+
+    def build(self, triangles):
+        triangle_min, triangle_max = triangles.min(axis=1), triangles.max(axis=1)
+        order = np.argsort(self.morton_codes((triangle_min + triangle_max) / 2), kind='stable').astype(np.int32)
+
+        leaf_count = max(1, -(-self.triangle_count // self.leaf_size))
+        leaf_count = 1 << (leaf_count - 1).bit_length()  # complete tree, padded with empty leaves
+        padded_min = np.full((leaf_count * self.leaf_size, 3), np.inf, dtype=np.float32)
+        padded_max = np.full((leaf_count * self.leaf_size, 3), -np.inf, dtype=np.float32)
+        padded_min[:self.triangle_count] = triangle_min[order]
+        padded_max[:self.triangle_count] = triangle_max[order]
+
+        levels_min = [padded_min.reshape(leaf_count, self.leaf_size, 3).min(axis=1)]
+        levels_max = [padded_max.reshape(leaf_count, self.leaf_size, 3).max(axis=1)]
+        while len(levels_min[-1]) > 1:
+            levels_min.append(levels_min[-1].reshape(-1, 2, 3).min(axis=1))
+            levels_max.append(levels_max[-1].reshape(-1, 2, 3).max(axis=1))
+        return order, np.concatenate(levels_min[::-1]), np.concatenate(levels_max[::-1])
+
+    @staticmethod
+    def morton_codes(points):
+        lower, upper = points.min(axis=0), points.max(axis=0)
+        extent = np.where(upper > lower, upper - lower, 1)
+        quantized = ((points - lower) / extent * 1023).astype(np.uint32)
+        codes = np.zeros(len(points), dtype=np.uint32)
+        for bit in range(10):
+            for axis in range(3):
+                codes |= ((quantized[:, axis] >> bit) & 1) << (3 * bit + 2 - axis)
+        return codes
+
+    def nbytes(self):
+        return self.order.nbytes + self.node_min.nbytes + self.node_max.nbytes
+
+    def intersect(self, origin, direction):
+        # Returns the indexes of the triangles whose leaf box is crossed by the ray, walking the tree one level at a
+        # time so each level is a single vectorized slab test.
+        origin = np.asarray(origin, dtype=np.float64)
+        direction = np.asarray(direction, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inverted_direction = 1.0 / direction
+            nodes = np.zeros(1, dtype=np.int64)
+            first_leaf = self.leaf_count - 1
+            while len(nodes):
+                t1 = (self.node_min[nodes] - origin) * inverted_direction
+                t2 = (self.node_max[nodes] - origin) * inverted_direction
+                t_near = np.nanmax(np.minimum(t1, t2), axis=1)
+                t_far = np.nanmin(np.maximum(t1, t2), axis=1)
+                empty = self.node_min[nodes, 0] > self.node_max[nodes, 0]
+                nodes = nodes[(t_near <= t_far) & (t_far >= 0) & ~empty]
+                if not len(nodes) or nodes[0] >= first_leaf:
+                    break
+                nodes = np.stack((2 * nodes + 1, 2 * nodes + 2), axis=1).ravel()
+
+        leaves = nodes - first_leaf
+        candidates = (leaves[:, None] * self.leaf_size + np.arange(self.leaf_size)).ravel()
+        return self.order[candidates[candidates < self.triangle_count]]
@@ -0,0 +1,73 @@
+import time
+
+import numpy as np
+
+
+class EdgeIndex:
+    # Half-edge index of an indexed triangle mesh. Half-edge h = 3f + k runs from corner k to corner (k + 1) % 3 of
+    # face f. Half-edges are grouped by undirected edge by sorting integer edge keys, and each one points to its twin
+    # on the neighbouring face (-1 on a boundary). On a non-manifold edge the twins form a cycle through every face
+    # on the edge.
+    def __init__(self, vertexes, faces):
+        start = time.perf_counter()
+        self.vertexes = vertexes
+        self.faces = faces
+        self.face_count = len(faces)
+        self.order, self.edge_starts, self.edges, self.twin = self.build(np.asarray(faces), len(vertexes))
+        self.edge_count = len(self.edges)
+        self.neighbours = None
+        self.build_time = time.perf_counter() - start
+
+    @staticmethod
+    def build(faces, vertex_count):
+        corners = faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2)
+        low, high = corners.min(axis=1), corners.max(axis=1)
+        keys = low.astype(np.int64) * vertex_count + high
+        order = np.argsort(keys, kind='stable').astype(np.int32)  # half-edges, grouped by edge
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+        edge_starts = np.append(starts, len(order)).astype(np.int32)
+        edges = np.stack((low[order[starts]], high[order[starts]]), axis=1).astype(np.uint32)
+
+        counts = np.diff(edge_starts)
+        position = np.arange(len(order))
+        group_end = np.repeat(edge_starts[1:], counts)
+        following = np.where(position + 1 < group_end, position + 1, np.repeat(starts, counts))
+        twin = np.empty(len(order), dtype=np.int32)
+        twin[order] = np.where(np.repeat(counts > 1, counts), order[following], -1)
+        return order, edge_starts, edges, twin
+
+    def face_counts(self):
+        # Number of faces on each edge: 1 on a boundary, 2 on a manifold edge, more on a non-manifold one.
+        return np.diff(self.edge_starts)
+
+    def edge_faces(self, edges):
+        # First two faces of each of the given edges (the second is -1 on a boundary).
+        first = self.order[self.edge_starts[edges]]
+        return first // 3, np.where(self.twin[first] >= 0, self.twin[first] // 3, -1)
+
+    def boundary_edges(self):
+        return np.flatnonzero(self.face_counts() == 1)
+
+    def non_manifold_edges(self):
+        return np.flatnonzero(self.face_counts() > 2)
+
+    def is_closed_manifold(self):
+        return bool(np.all(self.face_counts() == 2))
+
+    def adjacency(self):
+        # Faces sharing an edge, as a CSR graph: the neighbours of face f are neighbours[offsets[f]:offsets[f + 1]].
+        if self.neighbours is None:
+            half_edges = np.flatnonzero(self.twin >= 0)
+            source, target = half_edges // 3, self.twin[half_edges] // 3
+            offsets = np.zeros(self.face_count + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum(np.bincount(source, minlength=self.face_count))
+            self.neighbours = offsets, target[np.argsort(source, kind='stable')].astype(np.int32)
+        return self.neighbours
+
+    def nbytes(self):
+        # The index itself; the vertexes and faces it was built on are not counted.
+        size = self.order.nbytes + self.edge_starts.nbytes + self.edges.nbytes + self.twin.nbytes
+        if self.neighbours is not None:
+            size += self.neighbours[0].nbytes + self.neighbours[1].nbytes
+        return size
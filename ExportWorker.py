@@ -0,0 +1,37 @@
+import time
+
+from PyQt6.QtCore import QThread, pyqtSignal
+
+from Serializer import Serializer
+
+
+class ExportWorker(QThread):
+    # Runs a serial range export off the GUI thread; the process pool reports back through queued signals so the
+    # event loop keeps running while parts are written.
+    progress = pyqtSignal(int, int)  # parts written, parts requested
+
+    def __init__(self, file_name, face, text_format, first, last, output_directory, fit=True,
+                 text_transform=None):
+        super().__init__()
+        self.file_name = file_name
+        self.face = face
+        self.text_format = text_format
+        self.first = first
+        self.last = last
+        self.output_directory = output_directory
+        self.fit = fit
+        self.text_transform = text_transform
+        self.file_names = []
+        self.error = None  # message of the exception that stopped the export, read once finished
+        self.duration = 0
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            serializer = Serializer(self.file_name, self.text_format, face=self.face, fit=self.fit,
+                                    text_transform=self.text_transform)
+            self.file_names = serializer.export_range_parallel(self.first, self.last, self.output_directory,
+                                                               progress=self.progress.emit)
+        except Exception as error:
+            self.error = str(error)
+        self.duration = time.perf_counter() - start
@@ -0,0 +1,441 @@
+import os
+
+import numpy as np
+
+from BVH import BVH
+from EdgeIndex import EdgeIndex
+from combining_stl import STL_RECORD
+
+LOD_THRESHOLD = 2000000  # triangles above which a decimated proxy is displayed while the camera moves
+PATCH_ANGLE = 10  # degrees between the normals of a selected face and the flat region grown around it
+TEXT_MARGIN = 0.1  # fraction of the face's extent left free on each side of fitted text
+
+
+def load_stl(file_name):
+    # Binary STLs are memory-mapped: the returned record array is a read-only view of the file and the triangles are
+    # paged in on demand instead of being read into a private copy. ASCII files are parsed by numpy-stl.
+    with open(file_name, "rb") as file:
+        header = file.read(84)
+    if len(header) == 84:
+        count = int(np.frombuffer(header, dtype="<u4", offset=80)[0])
+        if os.path.getsize(file_name) == 84 + count * STL_RECORD.itemsize:
+            if count == 0:
+                return np.zeros(0, dtype=STL_RECORD)
+            return np.memmap(file_name, dtype=STL_RECORD, mode="r", offset=84, shape=(count,))
+    import stl  # numpy-stl is only needed for ASCII files
+    return stl.mesh.Mesh.from_file(file_name, calculate_normals=False).data
+
+
+def ray_triangle_intersection(origin, direction, triangles, eps=0.000001):
+    # Batched Moller-Trumbore test of one ray, or of R rays when origin and direction are (R, 3), against an
+    # (F, 3, 3) triangle array. A single ray returns the hit face indexes and their ray parameter t; several rays
+    # return (ray indexes, face indexes, t) for every hit pair.
+    triangles = np.asarray(triangles, dtype=np.float64)
+    origin = np.asarray(origin, dtype=np.float64)
+    direction = np.asarray(direction, dtype=np.float64)
+    single_ray = origin.ndim == 1
+    origin, direction = origin.reshape(-1, 1, 3), direction.reshape(-1, 1, 3)
+
+    point1 = triangles[:, 0]
+    edge1 = triangles[:, 1] - point1
+    edge2 = triangles[:, 2] - point1
+
+    cross_product = np.cross(direction, edge2)
+    det = np.einsum('rfk,fk->rf', cross_product, edge1)
+    parallel = np.abs(det) < eps  # no intersection
+    inverted_det = 1.0 / np.where(parallel, 1.0, det)
+
+    tvec = origin - point1
+    u = np.einsum('rfk,rfk->rf', tvec, cross_product) * inverted_det
+    qvec = np.cross(tvec, edge1)
+    v = np.einsum('rk,rfk->rf', direction[:, 0], qvec) * inverted_det
+    t = np.einsum('fk,rfk->rf', edge2, qvec) * inverted_det
+
+    hit = ~parallel & (u >= 0.0) & (u <= 1.0) & (v >= 0.0) & (u + v <= 1.0) & (t >= eps)
+    rays, faces = np.nonzero(hit)
+    if single_ray:
+        return faces, t[rays, faces]
+    return rays, faces, t[rays, faces]
+
+
+def closest_intersection(origin, direction, triangles):
+    # Index of the first triangle along the ray, ranked by the ray parameter, or None when nothing is hit.
+    faces, t = ray_triangle_intersection(origin, direction, triangles)
+    if not len(faces):
+        return None, np.inf
+    closest = np.argmin(t)
+    return faces[closest], t[closest]
+
+
+def rotation_matrix(angle, x, y, z):
+    # 4x4 rotation of angle degrees around (x, y, z), the same matrix as QMatrix4x4.rotate.
+    axis = np.array([x, y, z], dtype=np.float64) / np.linalg.norm([x, y, z])
+    cross = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+    angle = np.deg2rad(angle)
+    matrix = np.eye(4)
+    matrix[:3, :3] = np.eye(3) + np.sin(angle) * cross + (1 - np.cos(angle)) * cross.dot(cross)
+    return matrix
+
+
+def face_frame(face):
+    # Center and unit normal of a (3, 3) triangle.
+    face = np.asarray(face, dtype=np.float64)
+    normal = np.cross(face[1] - face[0], face[2] - face[0])
+    return face.mean(axis=0), normal / np.linalg.norm(normal)
+
+
+def placement_frame(normal, writing_direction=None):
+    # Orthonormal (writing direction, up, normal) frame on a face. Text runs horizontally, or along x on faces that
+    # are (nearly) horizontal, and reads upright when the face is seen from outside.
+    normal = np.asarray(normal, dtype=np.float64) / np.linalg.norm(normal)
+    if writing_direction is None:
+        writing_direction = np.cross([0, 0, 1], normal)
+        if np.linalg.norm(writing_direction) < 0.000001:
+            writing_direction = np.array([1.0, 0, 0])
+    writing_direction = np.asarray(writing_direction, dtype=np.float64)
+    writing_direction = writing_direction - normal * writing_direction.dot(normal)
+    writing_direction /= np.linalg.norm(writing_direction)
+    return writing_direction, np.cross(normal, writing_direction), normal
+
+
+def placement_matrix(center, normal, scale, writing_direction=None):
+    # 4x4 transform from glyph space (x along the text, z up, y through the thickness, front at -y) onto the face.
+    writing_direction, up, normal = placement_frame(normal, writing_direction)
+    matrix = np.eye(4)
+    matrix[:3, 0] = writing_direction * scale
+    matrix[:3, 1] = -normal * scale
+    matrix[:3, 2] = up * scale
+    matrix[:3, 3] = center
+    return matrix
+
+
+def layout_transforms(center, normal, offsets, scale, writing_direction=None):
+    # One 4x4 placement per glyph of a text block: offsets (N, 2) are the glyph origins in glyph space (x along the
+    # text, z up) relative to center, and scale maps glyph space units onto the part.
+    writing_direction, up, normal = placement_frame(normal, writing_direction)
+    matrix = placement_matrix(center, normal, scale, writing_direction)
+    offsets = np.asarray(offsets, dtype=np.float64).reshape(-1, 2) * scale
+    transforms = np.repeat(matrix[np.newaxis], len(offsets), axis=0)
+    transforms[:, :3, 3] += np.outer(offsets[:, 0], writing_direction) + np.outer(offsets[:, 1], up)
+    return transforms
+
+
+def text_transforms(offsets):
+    # Plain glyph space translations, one per glyph, moving each glyph to its (N, 2) offset (x along the text, z up).
+    offsets = np.asarray(offsets, dtype=np.float64).reshape(-1, 2)
+    transforms = np.repeat(np.eye(4)[np.newaxis], len(offsets), axis=0)
+    transforms[:, 0, 3] = offsets[:, 0]
+    transforms[:, 2, 3] = offsets[:, 1]
+    return transforms
+
+
+def text_frame(minimum, maximum, origin, normal, scale, writing_direction=None):
+    # 4x4 transform from the text space of a block (glyph space with its origin at the center of the bounds
+    # minimum..maximum) onto the face, for a block whose own origin is placed at origin. Rotations applied in text
+    # space turn the block around its center, along the text's own axes.
+    center = (np.asarray(minimum, dtype=np.float64) + maximum) / 2
+    return placement_matrix(origin, normal, scale, writing_direction) @ text_transforms(center)[0]
+
+
+def part_text_scale(dimensions):
+    # Glyph scale following the size of the whole part, used when text is not fitted to its face.
+    return (dimensions["width"] * dimensions["length"] * dimensions["height"]) ** 0.33 / 100
+
+
+def text_origin(minimum, maximum, scale, center, axes):
+    # Where the origin of a text block with glyph space bounds minimum..maximum goes for the block to be centered on
+    # center, given the (writing direction, up) axes it is laid along.
+    return center - ((minimum + maximum) / 2 * scale) @ np.asarray(axes)[:2]
+
+
+def fit_text(minimum, maximum, patch, margin=TEXT_MARGIN, extent=None):
+    # Largest scale at which a text block with glyph space bounds minimum..maximum fits in the patch's 2D extent,
+    # less margin (a fraction of the extent) on every side, and the file coordinates of the block's origin once it
+    # is centered on that extent. Both sides of the block grow linearly with the scale, so it is the smaller ratio.
+    # A given (width, height) extent is fitted instead of the block's own size, so the texts of a range can share
+    # the scale of the widest one (see TextLayout.extent).
+    if not 0 <= margin < 0.5:
+        raise ValueError(f"the margin must be at least 0 and less than 0.5 of the face, not {margin}")
+    size = maximum - minimum if extent is None else np.asarray(extent, dtype=np.float64)
+    available = (patch["maximum"] - patch["minimum"]) * (1 - 2 * margin)
+    sized = size > 0  # a text without glyphs has no extent, and any scale fits it
+    scale = float(np.min(available[sized] / size[sized])) if sized.any() else 0.0
+    extent_center = patch["centroid"] + (patch["minimum"] + patch["maximum"]) / 2 @ patch["axes"][:2]
+    return scale, text_origin(minimum, maximum, scale, extent_center, patch["axes"])
+
+
+def place_glyphs(glyphs, transforms):
+    # Every glyph's vertexes moved by its own transform in one batched product; glyphs that are None (spaces) are
+    # skipped. Returns the (F, 3, 3) triangles of the whole string.
+    placed = [(glyph["vertexes"], index) for index, glyph in enumerate(glyphs) if glyph is not None]
+    if not placed:
+        return np.empty((0, 3, 3), dtype=np.float32)
+    vertexes = np.concatenate([vertexes for vertexes, _ in placed])
+    owner = np.repeat([index for _, index in placed], [len(vertexes) for vertexes, _ in placed])
+    transforms = np.asarray(transforms)
+    moved = np.einsum('vij,vj->vi', transforms[owner, :3, :3], vertexes) + transforms[owner, :3, 3]
+    return moved.astype(np.float32).reshape(-1, 3, 3)
+
+
+def weld_vertexes(triangles, tolerance=0.00001):
+    # Snaps the (F, 3, 3) triangle soup to a grid of the given tolerance and keeps one vertex per grid cell (sort
+    # based), giving a compact (V, 3) vertex array and (F, 3) faces in the original face order. The three cell
+    # coordinates are packed into one integer key when they fit, and lexsorted otherwise: both are several times
+    # faster than np.unique(axis=0).
+    points = np.asarray(triangles, dtype=np.float32).reshape(-1, 3)
+    if not len(points):
+        return points, np.zeros((0, 3), dtype=np.uint32)
+    keys = np.round(points / tolerance).astype(np.int64)
+    keys -= keys.min(axis=0)
+    bits = [int(span).bit_length() for span in keys.max(axis=0)]
+    if sum(bits) <= 63:
+        packed = (keys[:, 0] << (bits[1] + bits[2])) | (keys[:, 1] << bits[2]) | keys[:, 2]
+        order = np.argsort(packed, kind='stable')
+        sorted_keys = packed[order]
+        new = np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1]))
+    else:
+        order = np.lexsort((keys[:, 2], keys[:, 1], keys[:, 0]))
+        sorted_keys = keys[order]
+        new = np.concatenate(([True], np.any(sorted_keys[1:] != sorted_keys[:-1], axis=1)))
+    inverse = np.empty(len(order), dtype=np.uint32)
+    inverse[order] = np.cumsum(new) - 1
+    return points[order[new]], inverse.reshape(-1, 3)
+
+
+def feature_edges(edge_index, normals, angle=30):
+    # Segments (E, 2, 3) worth drawing: every edge shared by two faces whose normals differ by more than angle
+    # degrees, plus boundary and non-manifold edges. Each edge is listed once, whatever the number of faces on it.
+    counts = edge_index.face_counts()
+    feature = counts != 2
+    shared = np.flatnonzero(counts == 2)
+    first, second = edge_index.edge_faces(shared)
+    feature[shared] = np.einsum('ij,ij->i', normals[first], normals[second]) < np.cos(np.deg2rad(angle))
+    return edge_index.vertexes[edge_index.edges[feature]]
+
+
+def face_normals(triangles):
+    # (F, 3) unit normals; degenerate faces get a zero normal.
+    triangles = np.asarray(triangles, dtype=np.float64)
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    return normals / np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), np.finfo(np.float64).tiny)
+
+
+def grow_region(seed, normals, adjacency, angle=PATCH_ANGLE):
+    # Every face connected to seed through shared edges whose normal is within angle degrees of the seed's normal,
+    # grown one ring of neighbours at a time. Returns the sorted face indexes.
+    offsets, neighbours = adjacency
+    limit = np.cos(np.deg2rad(angle))
+    visited = np.zeros(len(normals), dtype=bool)
+    visited[seed] = True
+    frontier = np.array([seed])
+    while len(frontier):
+        starts, counts = offsets[frontier], offsets[frontier + 1] - offsets[frontier]
+        index = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        candidates = np.unique(neighbours[index])
+        candidates = candidates[~visited[candidates]]
+        candidates = candidates[normals[candidates] @ normals[seed] >= limit]
+        visited[candidates] = True
+        frontier = candidates
+    return np.flatnonzero(visited)
+
+
+def patch_frame(triangles, region):
+    # Area, area-weighted centroid and normal of a set of faces, their in-plane principal axes (major first) and
+    # their 2D extent along those axes, measured from the centroid.
+    patch = np.asarray(triangles[region], dtype=np.float64)
+    cross = np.cross(patch[:, 1] - patch[:, 0], patch[:, 2] - patch[:, 0])
+    areas = np.linalg.norm(cross, axis=1) / 2
+    area = float(areas.sum())
+    if area <= 0:
+        raise ValueError("the selected faces have no area")
+    centers = patch.mean(axis=1)
+    centroid = (centers * areas[:, None]).sum(axis=0) / area
+    normal = cross.sum(axis=0)
+    normal /= np.linalg.norm(normal)
+
+    # Principal axes of the patch's second moment of area in its plane, oriented like the default writing direction
+    # so the text is not upside down. For a triangle, the integral of x x^T is area / 12 * (sum of v v^T + s s^T)
+    # with s the sum of its vertexes.
+    default_direction, default_up, _ = placement_frame(normal)
+    points = patch.reshape(-1, 3) - centroid
+    planar = (points @ np.stack((default_direction, default_up), axis=1)).reshape(-1, 3, 2)
+    sums = planar.sum(axis=1)
+    moment = np.einsum('f,fvi,fvj->ij', areas, planar, planar) + np.einsum('f,fi,fj->ij', areas, sums, sums)
+    values, vectors = np.linalg.eigh(moment)
+    major = vectors[:, 1] @ np.stack((default_direction, default_up))
+    if values[1] - values[0] <= 0.01 * values[1]:  # square or round: no major axis, keep the default direction
+        major = default_direction
+    elif major @ default_direction < 0 or (abs(major @ default_direction) < 0.000001 and major @ default_up < 0):
+        major = -major
+    axes = np.stack((major, np.cross(normal, major), normal))
+    coordinates = points @ axes[:2].T
+    return {"faces": region,
+            "area": area,
+            "centroid": centroid,
+            "normal": normal,
+            "axes": axes,
+            "minimum": coordinates.min(axis=0),
+            "maximum": coordinates.max(axis=0)}
+
+
+def select_patch(triangles, face, angle=PATCH_ANGLE, normals=None, adjacency=None):
+    # The (nearly) flat region around face, see patch_frame, or the face alone when angle is None. The face normals
+    # and the face adjacency are computed when not given; MeshGeometry passes the ones it keeps.
+    if angle is None:
+        return patch_frame(triangles, np.array([face]))
+    if normals is None:
+        normals = face_normals(triangles)
+    if adjacency is None:
+        adjacency = EdgeIndex(*weld_vertexes(triangles)).adjacency()
+    return patch_frame(triangles, grow_region(face, normals, adjacency, angle))
+
+
+def triangle_bounds(triangles, chunk_size=262144):
+    # (minimum, maximum) corners of (F, 3, 3) triangles, reduced a chunk at a time so a file mapping is not copied.
+    minimum, maximum = np.full(3, np.inf, dtype=np.float32), np.full(3, -np.inf, dtype=np.float32)
+    for start in range(0, len(triangles), chunk_size):
+        chunk = triangles[start:start + chunk_size]
+        minimum = np.minimum(minimum, chunk.min(axis=(0, 1)))
+        maximum = np.maximum(maximum, chunk.max(axis=(0, 1)))
+    return minimum, maximum
+
+
+def bounds_dimensions(minimum, maximum):
+    minx, miny, minz = (float(value) for value in minimum)
+    maxx, maxy, maxz = (float(value) for value in maximum)
+    return {"width": maxx - minx,
+            "length": maxy - miny,
+            "height": maxz - minz,
+            "minx": minx,
+            "maxx": maxx,
+            "miny": miny,
+            "maxy": maxy,
+            "minz": minz,
+            "maxz": maxz}
+
+
+def decimate(triangles, target=500000):
+    # Vertex clustering: snaps the vertexes to a uniform grid sized for roughly target output triangles, merges each
+    # occupied cell into the mean of its vertexes and drops the faces that collapse or repeat. Returns (V, 3) vertexes
+    # and (F, 3) faces.
+    points = np.asarray(triangles, dtype=np.float32).reshape(-1, 3)
+    minimum = points.min(axis=0)
+    cells = max(1, int(np.sqrt(target / 6)))  # a surface spanning the box covers about 3 * cells ** 2 cells
+    cell_size = max(float((points.max(axis=0) - minimum).max()) / cells, np.finfo(np.float32).tiny)
+    cell = np.minimum(((points - minimum) / cell_size).astype(np.int64), cells)
+    keys = (cell[:, 0] * (cells + 1) + cell[:, 1]) * (cells + 1) + cell[:, 2]
+    _, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.ravel()
+
+    count = np.bincount(inverse)
+    vertexes = np.stack([np.bincount(inverse, weights=points[:, axis]) for axis in range(3)], axis=1) / count[:, None]
+    faces = inverse.reshape(-1, 3)
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+    ordered = np.sort(faces, axis=1)
+    if len(vertexes) < 1 << 21:  # three indexes packed into one integer key
+        _, first = np.unique((ordered[:, 0] << 42) | (ordered[:, 1] << 21) | ordered[:, 2], return_index=True)
+    else:
+        _, first = np.unique(ordered, axis=0, return_index=True)
+    return vertexes.astype(np.float32), faces[np.sort(first)].astype(np.uint32)
+
+
+class MeshGeometry:
+    # The triangles of an STL file and everything derived from them with NumPy only: bounds, the centering offset,
+    # the optional welded vertexes, the search tree and the display proxy. Nothing here needs Qt or a GL context.
+    def __init__(self, file_name, weld=None, progress=None):
+        self.records = load_stl(file_name)
+        self.triangles = self.records["vectors"]  # (F, 3, 3) strided view of the triangle records
+        self.offset = np.zeros(3)
+        self.weld = weld  # welding tolerance, None keeps the unshared triangle soup
+        self.weld_stats = None
+        self.faces = None  # (F, 3) indexes into vertexes once welded
+        self.proxy = None
+        self.bvh = None
+        self.normals = None
+        self.edge_index = None
+        self.bounds, self.vertexes = self.read_triangles(progress)
+        if self.weld is not None:
+            self.weld_triangles()
+        self.center_mesh()
+
+    def read_triangles(self, progress=None, chunk_size=262144):
+        # A single pass over the records: each chunk is copied into the contiguous buffer the GL upload uses and
+        # reduced into the bounds, then progress(bytes, triangles) is called. Nothing here touches Qt, so it can run
+        # on a worker thread.
+        count = len(self.triangles)
+        vertexes = np.empty((count, 3, 3), dtype=np.float32)
+        minimum, maximum = np.full(3, np.inf, dtype=np.float32), np.full(3, -np.inf, dtype=np.float32)
+        for start in range(0, count, chunk_size):
+            chunk = vertexes[start:start + chunk_size]
+            chunk[:] = self.triangles[start:start + chunk_size]
+            chunk_minimum, chunk_maximum = triangle_bounds(chunk)
+            minimum, maximum = np.minimum(minimum, chunk_minimum), np.maximum(maximum, chunk_maximum)
+            if progress is not None:
+                done = start + len(chunk)
+                progress(84 + done * STL_RECORD.itemsize, done)
+        return (minimum, maximum), vertexes
+
+    def weld_triangles(self):
+        self.vertexes, self.faces = weld_vertexes(self.vertexes, self.weld)
+        self.invalidate()
+        self.weld_stats = {"vertexes_before": self.triangles.shape[0] * 3,
+                           "vertexes_after": len(self.vertexes),
+                           "bytes_before": self.triangles.shape[0] * 9 * 4,
+                           "bytes_after": self.vertexes.nbytes + self.faces.nbytes}
+
+    def face_vertexes(self):
+        # (F, 3, 3) triangles of the display buffer, welded or not.
+        return self.vertexes if self.faces is None else self.vertexes[self.faces]
+
+    def get_dimensions(self):
+        # Bounds of the displayed (centered) mesh, from the bounds reduced once at load.
+        return bounds_dimensions(self.bounds[0] + self.offset, self.bounds[1] + self.offset)
+
+    def center_mesh(self):
+        # The vertexes keep their file coordinates (they may be a read-only file mapping): centering is a translation
+        # by offset, applied by whatever displays the mesh, and picking maps rays back by subtracting it.
+        self.offset = -(self.bounds[0].astype(np.float64) + self.bounds[1]) / 2
+
+    def transform(self):
+        # 4x4 matrix from file coordinates to the centered display coordinates.
+        matrix = np.eye(4)
+        matrix[:3, 3] = self.offset
+        return matrix
+
+    def get_bvh(self):
+        # Built on first use and kept until the triangles themselves change.
+        if self.bvh is None:
+            self.bvh = BVH(self.triangles)
+        return self.bvh
+
+    def get_normals(self):
+        if self.normals is None:
+            self.normals = face_normals(self.triangles)
+        return self.normals
+
+    def get_edge_index(self):
+        # Which faces share which edge, built once per geometry (MeshLoader builds it with the rest of the load). The
+        # triangles are welded for it unless they already are.
+        if self.edge_index is None:
+            if self.faces is None:
+                self.edge_index = EdgeIndex(*weld_vertexes(self.triangles))
+            else:
+                self.edge_index = EdgeIndex(self.vertexes, self.faces)
+        return self.edge_index
+
+    def select_patch(self, face, angle=PATCH_ANGLE):
+        # The (nearly) flat region around face, in file coordinates, with the normals and edge index kept here.
+        return select_patch(self.triangles, face, angle, self.get_normals(), self.get_edge_index().adjacency())
+
+    def invalidate(self):
+        # Drops everything derived from the triangles; called whenever the vertexes or faces are replaced.
+        self.bvh = None
+        self.normals = None
+        self.edge_index = None
+        self.proxy = None
+
+    def get_proxy(self):
+        # Only large meshes get a proxy; it is built with the rest of the load, on the loading thread.
+        if self.proxy is None and len(self.triangles) > LOD_THRESHOLD:
+            self.proxy = decimate(self.face_vertexes())
+        return self.proxy
@@ -0,0 +1,144 @@
+import os
+
+import numpy as np
+
+GLYPH_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "STL_Characters")
+ATLAS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "glyphs.atlas")
+# The glyph files are read from +y with z pointing down, and share this baseline; glyph space has x along the text
+# starting at the glyph's left edge, z up from the baseline and the front at -y.
+GLYPH_BASELINE = -40.0
+
+# Atlas layout: one header, one table entry per glyph, then the float32 (N, 3) vertex blocks the entries point to.
+ATLAS_MAGIC = b"MCATLAS1"
+ATLAS_HEADER = np.dtype([("magic", "S8"), ("glyph_count", "<u4"), ("reserved", "<u4")])
+ATLAS_ENTRY = np.dtype([("char", "<U1"), ("vertex_count", "<u4"), ("offset", "<u8"),
+                        ("minimum", "<f4", (3,)), ("maximum", "<f4", (3,)), ("advance", "<f4")])
+
+
+def make_glyph(vertexes, minimum, maximum, advance):
+    width, length, height = (float(value) for value in np.subtract(maximum, minimum))
+    return {"vertexes": vertexes,
+            "advance": float(advance),
+            "dimensions": {"width": width, "length": length, "height": height,
+                           "minx": float(minimum[0]), "maxx": float(maximum[0]),
+                           "miny": float(minimum[1]), "maxy": float(maximum[1]),
+                           "minz": float(minimum[2]), "maxz": float(maximum[2])}}
+
+
+def write_atlas(glyphs, file_name=ATLAS_FILE):
+    entries = np.zeros(len(glyphs), dtype=ATLAS_ENTRY)
+    offset = ATLAS_HEADER.itemsize + entries.nbytes
+    for entry, (char, glyph) in zip(entries, sorted(glyphs.items())):
+        dimensions = glyph["dimensions"]
+        entry["char"] = char
+        entry["vertex_count"] = len(glyph["vertexes"])
+        entry["offset"] = offset
+        entry["minimum"] = dimensions["minx"], dimensions["miny"], dimensions["minz"]
+        entry["maximum"] = dimensions["maxx"], dimensions["maxy"], dimensions["maxz"]
+        entry["advance"] = glyph["advance"]
+        offset += glyph["vertexes"].nbytes
+
+    header = np.array([(ATLAS_MAGIC, len(glyphs), 0)], dtype=ATLAS_HEADER)
+    with open(file_name, "wb") as file:
+        file.write(header.tobytes())
+        file.write(entries.tobytes())
+        for char in sorted(glyphs):
+            file.write(np.ascontiguousarray(glyphs[char]["vertexes"], dtype="<f4").tobytes())
+    return offset
+
+
+def read_atlas(file_name=ATLAS_FILE):
+    # The vertex arrays are views into one read-only memory map, nothing is copied.
+    atlas = np.memmap(file_name, dtype=np.uint8, mode="r")
+    header = atlas[:ATLAS_HEADER.itemsize].view(ATLAS_HEADER)[0]
+    if header["magic"] != ATLAS_MAGIC:
+        raise ValueError(f"{file_name} is not a glyph atlas")
+    table_end = ATLAS_HEADER.itemsize + int(header["glyph_count"]) * ATLAS_ENTRY.itemsize
+    glyphs = {}
+    for entry in atlas[ATLAS_HEADER.itemsize:table_end].view(ATLAS_ENTRY):
+        start = int(entry["offset"])
+        end = start + int(entry["vertex_count"]) * 12
+        vertexes = atlas[start:end].view("<f4").reshape(-1, 3)
+        glyphs[str(entry["char"])] = make_glyph(vertexes, entry["minimum"], entry["maximum"], entry["advance"])
+    return glyphs
+
+
+class GlyphCache:
+    # Parsed character meshes in glyph space, keyed by character. When a packed atlas at least as recent as the glyph
+    # directory exists, every glyph is mapped from it at startup; otherwise glyphs are read from their STL file the
+    # first time they are asked for (or all at once with preload). Both are dropped when the directory changes.
+    def __init__(self, directory=GLYPH_DIRECTORY, atlas=ATLAS_FILE, preload=False):
+        self.directory = directory
+        self.atlas = atlas
+        self.glyphs = {}
+        self.generation = 0  # incremented whenever the glyphs are dropped, so layouts built on them can be too
+        self.signature = self.directory_signature()
+        self.file_names = {entry[0] for entry in self.signature}
+        self.load_atlas()
+        if preload:
+            self.preload()
+
+    @staticmethod
+    def file_name(char):
+        if char.isdigit():
+            return char + ".stl"
+        if char.islower():
+            return "lower_" + char + ".stl"
+        return "upper_" + char + ".stl"
+
+    def has_glyph(self, char):
+        # Space, the serial number placeholder and characters without a glyph file only take room.
+        return char not in (" ", "*") and (char in self.glyphs or self.file_name(char) in self.file_names)
+
+    def directory_signature(self):
+        with os.scandir(self.directory) as entries:
+            return frozenset((entry.name, entry.stat().st_size, entry.stat().st_mtime_ns) for entry in entries)
+
+    def check_directory(self):
+        signature = self.directory_signature()
+        if signature != self.signature:
+            self.signature = signature
+            self.file_names = {entry[0] for entry in signature}
+            self.invalidate()
+
+    def invalidate(self):
+        self.glyphs.clear()
+        self.generation += 1
+        self.load_atlas()
+
+    def atlas_is_current(self):
+        if self.atlas is None or not os.path.exists(self.atlas):
+            return False
+        newest_glyph = max((entry[2] for entry in self.signature), default=0)
+        return os.stat(self.atlas).st_mtime_ns >= newest_glyph
+
+    def load_atlas(self):
+        if self.atlas_is_current():
+            self.glyphs.update(read_atlas(self.atlas))
+
+    def load(self, char):
+        import stl  # only needed when a glyph is not in the atlas
+        points = stl.mesh.Mesh.from_file(os.path.join(self.directory, self.file_name(char))).points
+        points = points.reshape(-1, 3)
+        minimum, maximum = points.min(axis=0), points.max(axis=0)
+        # Turned half a turn around x into glyph space, centered through the thickness.
+        vertexes = np.stack((points[:, 0] - minimum[0], (minimum[1] + maximum[1]) / 2 - points[:, 1],
+                             GLYPH_BASELINE - points[:, 2]), axis=1).astype(np.float32)
+        return make_glyph(vertexes, vertexes.min(axis=0), vertexes.max(axis=0), maximum[0] - minimum[0])
+
+    def get(self, char):
+        if not self.has_glyph(char):
+            return None
+        if char not in self.glyphs:
+            self.glyphs[char] = self.load(char)
+        return self.glyphs[char]
+
+    def preload(self):
+        self.check_directory()
+        for name in self.file_names:
+            char = os.path.splitext(name)[0].split("_")[-1]
+            if len(char) == 1:
+                self.get(char)
+
+    def nbytes(self):
+        return sum(glyph["vertexes"].nbytes for glyph in self.glyphs.values())
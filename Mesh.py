@@ -1,21 +1,52 @@
-import numpy as np
 import pyqtgraph.opengl as gl
-import stl
 
+from Geometry import MeshGeometry, feature_edges
 
-class Mesh:
-    def __init__(self, file_name, char=False):
-        self.file = stl.mesh.Mesh.from_file(file_name)
+
+class Mesh(MeshGeometry):
+    # Rendering adapter over MeshGeometry: the MeshData and the GL items are only created when first asked for, on
+    # the thread that displays them, and carry the geometry's centering offset as their transform.
+    def __init__(self, file_name, char=False, weld=None, progress=None):
         self.char = char # True if character, False if mesh
-        self.data = self.convert_data()
-        self.mesh = self.convert_to_stl()
-        self.center_mesh()
+        self.mesh_data = None
+        self.item = None
+        self.edge_item = None
+        self.proxy_item = None
+        super().__init__(file_name, weld, progress)
+
+    @property
+    def data(self):
+        # Face indexed MeshData around the contiguous copy made for the GL upload.
+        if self.mesh_data is None:
+            self.mesh_data = gl.MeshData(vertexes=self.vertexes, faces=self.faces)
+        return self.mesh_data
+
+    @property
+    def mesh(self):
+        # The GL item is only created when first asked for, on the thread that displays it.
+        if self.item is None:
+            self.item = self.convert_to_stl()
+            self.item.translate(*self.offset)
+        return self.item
 
-    def convert_data(self):
-        points = self.file.points.reshape(-1, 3)
-        faces = np.arange(points.shape[0]).reshape(-1, 3)
-        data = gl.MeshData(faces=faces, vertexes=points)
-        return data
+    @property
+    def edge_mesh(self):
+        # Feature edges as a single line buffer, computed the first time they are displayed.
+        if self.edge_item is None:
+            segments = feature_edges(self.get_edge_index(), self.get_normals())
+            self.edge_item = gl.GLLinePlotItem(pos=segments.reshape(-1, 3), mode='lines', color=(1, 1, 1, 1))
+            self.edge_item.translate(*self.offset)
+        return self.edge_item
+
+    @property
+    def proxy_mesh(self):
+        # Decimated stand-in shown while the camera moves; picking and export always use the full triangles.
+        if self.proxy_item is None:
+            vertexes, faces = self.get_proxy()
+            self.proxy_item = gl.GLMeshItem(meshdata=gl.MeshData(vertexes=vertexes, faces=faces), smooth=False,
+                                            drawFaces=False, drawEdges=True, edgeColor=(1, 1, 1, 1))
+            self.proxy_item.translate(*self.offset)
+        return self.proxy_item
 
     def convert_to_stl(self):
         if self.char:
@@ -27,45 +58,9 @@ class Mesh:
                                  edgeColor=(1, 1, 1, 1))
         return mesh
 
-    def get_dimensions(self):
-        minx = maxx = miny = maxy = minz = maxz = None
-        for point in self.file.points:
-            if minx is None:
-                minx = point[stl.Dimension.X]
-                maxx = point[stl.Dimension.X]
-                miny = point[stl.Dimension.Y]
-                maxy = point[stl.Dimension.Y]
-                minz = point[stl.Dimension.Z]
-                maxz = point[stl.Dimension.Z]
-            else:
-                maxx = max(point[stl.Dimension.X], maxx)
-                minx = min(point[stl.Dimension.X], minx)
-                maxy = max(point[stl.Dimension.Y], maxy)
-                miny = min(point[stl.Dimension.Y], miny)
-                maxz = max(point[stl.Dimension.Z], maxz)
-                minz = min(point[stl.Dimension.Z], minz)
-
-        dimensions = {"width": maxx - minx,
-                      "length": maxy - miny,
-                      "height": maxz - minz,
-                      "minx": minx,
-                      "maxx": maxx,
-                      "miny": miny,
-                      "maxy": maxy,
-                      "minz": minz,
-                      "maxz": maxz}
-        return dimensions
-
     def center_mesh(self):
-        dimensions = self.get_dimensions()
-        dx = -dimensions["minx"] - (dimensions["width"] / 2)
-        dy = -dimensions["miny"] - (dimensions["length"] / 2)
-        dz = -dimensions["minz"] - (dimensions["height"] / 2)
-        vertexes = []
-        for vertex in self.data.vertexes():
-            vertex[0] += dx
-            vertex[1] += dy
-            vertex[2] += dz
-            vertexes.append(vertex)
-        faces = np.arange(np.array(vertexes).shape[0]).reshape(-1, 3)
-        self.mesh.setMeshData(meshdata=gl.MeshData(faces=faces, vertexes=vertexes))
+        super().center_mesh()
+        for item in (self.item, self.edge_item, self.proxy_item):
+            if item is not None:
+                item.resetTransform()
+                item.translate(*self.offset)
@@ -0,0 +1,42 @@
+from PyQt6.QtCore import QThread, pyqtSignal
+
+from Mesh import Mesh
+
+
+class MeshLoader(QThread):
+    # Parses, bounds and copies a mesh into its upload buffer, builds its search tree, edge index and display proxy
+    # off the GUI thread. The GL items are created later, by Viewer.show_mesh on the GUI thread.
+    progress = pyqtSignal(int, int)  # bytes read, triangles processed
+    loaded = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, file_name, weld=None, parent=None):
+        super().__init__(parent)
+        self.file_name = file_name
+        self.weld = weld
+
+    def check_interruption(self):
+        if self.isInterruptionRequested():
+            raise InterruptedError
+
+    def report(self, bytes_read, triangles):
+        self.check_interruption()
+        self.progress.emit(bytes_read, triangles)
+
+    def run(self):
+        try:
+            mesh = Mesh(self.file_name, progress=self.report)
+            if self.weld is not None:
+                self.check_interruption()
+                mesh.weld = self.weld
+                mesh.weld_triangles()
+            for build in (mesh.get_bvh, mesh.get_edge_index, mesh.get_proxy):
+                self.check_interruption()  # a cancelled load stops between phases, not only while reading
+                build()
+        except InterruptedError:
+            return
+        except Exception as error:
+            self.failed.emit(str(error))
+            return
+        if not self.isInterruptionRequested():
+            self.loaded.emit(mesh)
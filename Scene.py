@@ -0,0 +1,60 @@
+from contextlib import contextmanager
+
+
+class Scene:
+    # Items displayed by a GLViewWidget, indexed by name and by category. Each name holds one item: adding under a
+    # name already in use replaces the previous item. Changes made inside batch() are followed by a single repaint.
+    CATEGORIES = {"axis": "helper", "grid": "helper", "aiming_dot": "helper",
+                  "stl": "model", "edges": "model", "proxy": "model",
+                  "face": "selection", "char": "selection"}
+
+    def __init__(self, view):
+        self.view = view
+        self.items = {}  # name -> {'mesh': GL item, 'data': MeshData or None, 'name': name, 'category': category}
+        self.categories = {}  # category -> {name: None}, kept in insertion order
+        self.batch_depth = 0
+        self.changed = False
+
+    def __contains__(self, name):
+        return name in self.items
+
+    def mesh(self, name):
+        item = self.items.get(name)
+        return None if item is None else item['mesh']
+
+    def names(self, category):
+        return list(self.categories.get(category, ()))
+
+    def add(self, item, data, name, category=None):
+        with self.batch():
+            self.remove(name)
+            category = category or self.CATEGORIES.get(name, "other")
+            self.view.addItem(item)
+            self.items[name] = {'mesh': item, 'data': data, 'name': name, 'category': category}
+            self.categories.setdefault(category, {})[name] = None
+            self.changed = True
+
+    def remove(self, *names):
+        # Returns the names that were displayed; unknown names are ignored.
+        removed = []
+        with self.batch():
+            for name in names:
+                item = self.items.pop(name, None)
+                if item is None:
+                    continue
+                self.view.removeItem(item['mesh'])
+                del self.categories[item['category']][name]
+                removed.append(name)
+                self.changed = True
+        return removed
+
+    @contextmanager
+    def batch(self):
+        self.batch_depth += 1
+        try:
+            yield self
+        finally:
+            self.batch_depth -= 1
+            if not self.batch_depth and self.changed:
+                self.changed = False
+                self.view.update()
@@ -0,0 +1,172 @@
+import multiprocessing
+import os
+import re
+import sys
+import types
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from GlyphCache import GlyphCache
+from TextLayout import TextLayout
+from combining_stl import combine
+from Geometry import PATCH_ANGLE, TEXT_MARGIN, bounds_dimensions, fit_text, load_stl, part_text_scale, place_glyphs, \
+    placement_frame, select_patch, text_frame, text_origin, text_transforms, triangle_bounds
+
+
+class Serializer:
+    # Headless serial number marking: writes one STL per serial number, made of the base part plus the serial's
+    # glyphs placed on the selected face. The base is parsed once and glyphs come from the shared cache, so each
+    # serial only costs its glyph transforms and one write.
+    def __init__(self, file_name=None, text_format="*", face=None, point=None, normal=None, glyph_cache=None,
+                 number_width=0, base=None, writing_direction=None, patch_angle=PATCH_ANGLE, patch=None, fit=True,
+                 margin=TEXT_MARGIN, text_transform=None, extent=None):
+        if base is None:
+            base = load_stl(file_name)
+        self.base = base
+        triangles = self.base["vectors"]
+        self.dimensions = bounds_dimensions(*triangle_bounds(triangles))
+
+        self.writing_direction = writing_direction
+        self.patch = patch  # flat region the text is fitted to, see Geometry.patch_frame
+        self.fit = fit
+        self.margin = margin
+        self.text_transform = text_transform  # the viewer's extra rotation and translation, see Viewer.char_transform
+        self.extent = extent  # glyph space extent fitted instead of each text's own, see fit_range
+        if face is not None:
+            # face index, in file order (the index picked in the viewer): the text is laid out on the flat region
+            # around it, as the viewer shows it, or on the face alone without a patch angle.
+            self.patch = select_patch(triangles, face, patch_angle)
+            self.center, self.normal, self.writing_direction = (self.patch["centroid"], self.patch["normal"],
+                                                                self.patch["axes"][0])
+        else:
+            self.center = np.asarray(point, dtype=np.float64)
+            self.normal = np.asarray(normal, dtype=np.float64) / np.linalg.norm(normal)
+
+        self.text_format = text_format
+        self.number_width = number_width
+        self.glyph_cache = glyph_cache if glyph_cache is not None else GlyphCache()
+        self.glyph_cache.check_directory()
+        self.text_layout = TextLayout(self.glyph_cache)
+
+    def serial_text(self, number):
+        return self.text_format.replace("*", str(number).zfill(self.number_width))
+
+    def serial_file_name(self, number, output_directory):
+        # The serial text, with the characters a file name cannot hold (path separators, line breaks...) replaced.
+        name = re.sub(r'[\\/:*?"<>|\x00-\x1f]', "_", self.serial_text(number)).strip(" .") or "_"
+        return os.path.join(output_directory, name + ".stl")
+
+    def check_range(self, first, last):
+        # Without "*" every serial number would be written to the same file.
+        if last > first and "*" not in self.text_format:
+            raise ValueError(f"the text {self.text_format!r} has no '*' for the serial number, every part of the "
+                             f"range would be written to the same file")
+
+    def fit_range(self, first, last):
+        # Every part of a range is marked at one size: the scale that fits its widest serial number.
+        if first <= last:
+            self.extent = self.text_layout.extent(self.serial_text(number) for number in range(first, last + 1))
+
+    def compose(self, text):
+        # (F, 3, 3) triangles of the glyphs of text, placed on the face. Outside of a range, each text is fitted on
+        # its own, so a longer text is written smaller rather than overflowing the face.
+        layout = self.text_layout.layout(text)
+        if self.fit and self.patch is not None:
+            scale, origin = fit_text(layout["minimum"], layout["maximum"], self.patch, self.margin, self.extent)
+        else:
+            scale = part_text_scale(self.dimensions)
+            origin = text_origin(layout["minimum"], layout["maximum"], scale, self.center,
+                                 placement_frame(self.normal, self.writing_direction))
+        # Text space to the face, as the viewer's item transform, with the operator's adjustment applied in text space.
+        frame = text_frame(layout["minimum"], layout["maximum"], origin, self.normal, scale, self.writing_direction)
+        if self.text_transform is not None:
+            frame = frame @ self.text_transform
+        center = (layout["minimum"] + layout["maximum"]) / 2
+        return place_glyphs(layout["glyphs"], frame @ text_transforms(layout["offsets"] - center))
+
+    def write(self, text, file_name):
+        return combine(file_name, self.base, self.compose(text))
+
+    def export_range(self, first, last, output_directory):
+        self.check_range(first, last)
+        self.fit_range(first, last)
+        os.makedirs(output_directory, exist_ok=True)
+        file_names = []
+        for number in range(first, last + 1):
+            file_name = self.serial_file_name(number, output_directory)
+            self.write(self.serial_text(number), file_name)
+            file_names.append(file_name)
+        return file_names
+
+    def export_range_parallel(self, first, last, output_directory, workers=None, progress=None):
+        # Same output as export_range, fanned out over a process pool. The base triangles are copied once into shared
+        # memory that every worker maps instead of being pickled to each of them; progress(done, total) is called
+        # from this thread as chunks complete.
+        self.check_range(first, last)
+        self.fit_range(first, last)
+        os.makedirs(output_directory, exist_ok=True)
+        numbers = list(range(first, last + 1))
+        workers = workers or os.cpu_count()
+        chunk_size = max(1, min(64, len(numbers) // (workers * 4)))
+        chunks = [numbers[index:index + chunk_size] for index in range(0, len(numbers), chunk_size)]
+        patch = None  # without its face indexes, which can be large and are not needed to fit the text
+        if self.patch is not None:
+            patch = {key: value for key, value in self.patch.items() if key != "faces"}
+        settings = {"text_format": self.text_format, "point": self.center, "normal": self.normal,
+                    "number_width": self.number_width, "writing_direction": self.writing_direction, "patch": patch,
+                    "fit": self.fit, "margin": self.margin, "text_transform": self.text_transform,
+                    "extent": self.extent}
+
+        memory = SharedMemory(create=True, size=max(1, self.base.nbytes))
+        try:
+            np.ndarray(self.base.shape, dtype=self.base.dtype, buffer=memory.buf)[:] = self.base
+            file_names = []
+            # spawn rather than fork: the caller is usually a Qt worker thread
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"), initializer=init_worker,
+                                     initargs=(memory.name, self.base.shape, self.base.dtype, settings)) as executor:
+                with worker_main_module():
+                    futures = [executor.submit(write_serials, chunk, output_directory) for chunk in chunks]
+                for future in as_completed(futures):
+                    file_names.extend(future.result())
+                    if progress is not None:
+                        progress(len(file_names), len(numbers))
+        finally:
+            memory.close()
+            memory.unlink()
+        return sorted(file_names)
+
+
+@contextmanager
+def worker_main_module():
+    # Spawned workers re-import the parent's __main__ before anything else; for the GUI that is main.py, which loads
+    # PyQt6 and pyqtgraph.opengl in every worker. The pool starts its processes as jobs are submitted, so while that
+    # happens __main__ is an empty module and the workers only import what init_worker and write_serials need.
+    main_module = sys.modules["__main__"]
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main_module
+
+
+worker_memory = None
+worker_serializer = None
+
+
+def init_worker(memory_name, shape, dtype, settings):
+    global worker_memory, worker_serializer
+    worker_memory = SharedMemory(name=memory_name)
+    base = np.ndarray(shape, dtype=dtype, buffer=worker_memory.buf)
+    worker_serializer = Serializer(base=base, **settings)
+
+
+def write_serials(numbers, output_directory):
+    file_names = []
+    for number in numbers:
+        file_name = worker_serializer.serial_file_name(number, output_directory)
+        worker_serializer.write(worker_serializer.serial_text(number), file_name)
+        file_names.append(file_name)
+    return file_names
@@ -0,0 +1,70 @@
+import numpy as np
+
+
+class TextLayout:
+    # Positions the glyphs of a string from the glyph cache's metrics, in glyph space (x along the text, z up, the
+    # first baseline at z = 0). Each character advances by its glyph's width plus the tracking, adjusted by the
+    # kerning table ({(left, right): glyph space units}); characters without a glyph advance by space_advance, and
+    # "\n" starts a new line line_height lower. Layouts are cached by string until the glyphs change, so the viewer
+    # and the exporters can share one instance. Looking a layout up does not rescan the glyph directory: callers
+    # check it once per batch of texts (GlyphCache.check_directory).
+    def __init__(self, glyph_cache, tracking=1.5, space_advance=5.0, line_height=14.0, kerning=None, align="center",
+                 cache_size=4096):
+        self.glyph_cache = glyph_cache
+        self.tracking = tracking
+        self.space_advance = space_advance
+        self.line_height = line_height
+        self.kerning = dict(kerning or {})
+        self.align = align  # "left" or "center", how lines are placed against each other
+        self.cache_size = cache_size
+        self.layouts = {}
+        self.generation = None
+
+    def layout(self, text):
+        # {"glyphs": glyph or None per character, "offsets": (N, 2) glyph origins, "minimum" / "maximum": bounds
+        # of the glyphs as laid out, "lines": line count}.
+        if self.generation != self.glyph_cache.generation:
+            self.layouts.clear()
+            self.generation = self.glyph_cache.generation
+        if text not in self.layouts:
+            if len(self.layouts) >= self.cache_size:
+                self.layouts.clear()
+            self.layouts[text] = self.build(text)
+        return self.layouts[text]
+
+    def extent(self, texts):
+        # Largest (width, height) among the layouts of texts: a scale that fits this extent fits every one of them.
+        return np.max([layout["maximum"] - layout["minimum"] for layout in map(self.layout, texts)], axis=0)
+
+    def build(self, text):
+        glyphs = [self.glyph_cache.get(char) for char in text]
+        if not text:
+            return {"glyphs": glyphs, "offsets": np.zeros((0, 2)), "minimum": np.zeros(2), "maximum": np.zeros(2),
+                    "lines": 0}
+        newline = np.array([char == "\n" for char in text], dtype=bool)
+        widths = np.array([0.0 if glyph is None else glyph["advance"] for glyph in glyphs])
+        advances = np.where(newline, 0.0, np.where([glyph is None for glyph in glyphs], self.space_advance,
+                                                   widths + self.tracking))
+        if self.kerning and len(text) > 1:
+            advances[:-1] += [self.kerning.get(pair, 0.0) for pair in zip(text, text[1:])]
+
+        # Pen positions: running sum of the advances, restarted at the first character of every line.
+        line = np.cumsum(newline) - newline  # a "\n" closes its own line
+        first = np.flatnonzero(np.concatenate(([True], newline[:-1])))
+        pen = np.cumsum(advances) - advances
+        x = pen - pen[first][line]
+        if self.align == "center" and len(text):
+            x -= (np.maximum.reduceat(x + widths, first) / 2)[line]
+        offsets = np.stack((x, -line * self.line_height), axis=1)
+
+        placed = np.array([glyph is not None for glyph in glyphs], dtype=bool)
+        if not placed.any():
+            return {"glyphs": glyphs, "offsets": offsets, "minimum": np.zeros(2), "maximum": np.zeros(2),
+                    "lines": len(first)}
+        bounds = np.array([[glyph["dimensions"][key] for key in ("minx", "minz", "maxx", "maxz")]
+                           for glyph in glyphs if glyph is not None])
+        return {"glyphs": glyphs,
+                "offsets": offsets,
+                "minimum": (offsets[placed] + bounds[:, :2]).min(axis=0),
+                "maximum": (offsets[placed] + bounds[:, 2:]).max(axis=0),
+                "lines": len(first)}
@@ -1,13 +1,14 @@
-from math import copysign
-
 import numpy as np
 import pyqtgraph.opengl as gl
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QVariantAnimation, QEasingCurve, QTimer
 from PyQt6.QtGui import QVector3D, QColor
-from PyQt6.QtTest import QTest
 from pyqtgraph.Vector import Vector
 
-from Mesh import Mesh
+from Geometry import closest_intersection, fit_text, part_text_scale, place_glyphs, rotation_matrix, text_frame, \
+    text_origin, text_transforms
+from GlyphCache import GlyphCache
+from Scene import Scene
+from TextLayout import TextLayout
 
 
 class Viewer(gl.GLViewWidget):
@@ -15,56 +16,141 @@ class Viewer(gl.GLViewWidget):
     def __init__(self):
         super().__init__()
         self.setMinimumSize(600, 600)
-        self.displayed_items = []
+        self.scene = Scene(self)
         self.dimensions_stl = None
+        self.stl_mesh = None
+        self.render_mode = "wireframe"  # "wireframe", "feature edges" or "shaded"
+        self.selected_face_index = None  # face index in file order, as the headless Serializer expects it
+        self.selected_patch = None  # flat region around the selected face, see Geometry.patch_frame
+        self.char_key = None  # text and face the displayed serial number was built for
+        self.char_anchor = None  # text space to scene transform the displayed serial number was built with
+        self.fit_to_face = True  # size the serial number to the selected face rather than to the whole part
+        self.glyph_cache = None  # mapped on first use, see get_glyph_cache
+        self.text_layout = None
         self.camera_distance = 40
         self.setCameraParams(distance=self.camera_distance, fov=60)
         self.center = Vector(0, 0, 0)
-        self.axis = gl.GLAxisItem()  # blue axis = x, yellow = y, green = z
-        self.axis.setVisible(False)
-        self.set_displayed_items(self.axis, None, "axis")
-        self.grid = gl.GLGridItem()
-        self.grid.setVisible(False)
-        self.set_displayed_items(self.grid, None, "grid")
-        self.aiming_dot = gl.GLScatterPlotItem(pos=self.cameraParams()['center'], size=10, color=(1, 0, 0, 1))
-        self.set_displayed_items(self.aiming_dot, None, "aiming_dot")
-        self.intersection_triangle = np.empty((3, 3))
+        # Helper items are created the first time they are used rather than before the window first paints.
+        self.axis_item = None
+        self.grid_item = None
+        self.aiming_dot_item = None
+        self.camera_travel = None
+        self.camera_animation = QVariantAnimation(self)
+        self.camera_animation.setDuration(500)
+        self.camera_animation.setStartValue(0.0)
+        self.camera_animation.setEndValue(1.0)
+        self.camera_animation.setEasingCurve(QEasingCurve.Type.InOutCubic)
+        self.camera_animation.valueChanged.connect(self.animate_camera)
+        self.proxy_shown = False
+        self.idle_timer = QTimer(self)  # back to full resolution once the camera has stopped for this long
+        self.idle_timer.setSingleShot(True)
+        self.idle_timer.setInterval(250)
+        self.idle_timer.timeout.connect(self.camera_idle)
+
+    @property
+    def axis(self):
+        if self.axis_item is None:
+            self.axis_item = gl.GLAxisItem()  # blue axis = x, yellow = y, green = z
+            self.axis_item.setVisible(False)
+            self.set_displayed_items(self.axis_item, None, "axis")
+        return self.axis_item
+
+    @property
+    def grid(self):
+        if self.grid_item is None:
+            self.grid_item = gl.GLGridItem()
+            self.grid_item.setVisible(False)
+            self.set_displayed_items(self.grid_item, None, "grid")
+        return self.grid_item
+
+    @property
+    def aiming_dot(self):
+        if self.aiming_dot_item is None:
+            self.aiming_dot_item = gl.GLScatterPlotItem(pos=self.cameraParams()['center'], size=10,
+                                                        color=(1, 0, 0, 1))
+            self.set_displayed_items(self.aiming_dot_item, None, "aiming_dot")
+        return self.aiming_dot_item
+
+    def get_glyph_cache(self):
+        if self.glyph_cache is None:
+            self.glyph_cache = GlyphCache()
+        return self.glyph_cache
+
+    def get_text_layout(self):
+        if self.text_layout is None:
+            self.text_layout = TextLayout(self.get_glyph_cache())
+        return self.text_layout
 
     def set_displayed_items(self, item, data, name):
-        self.addItem(item)
-        self.displayed_items.append({'mesh': item, 'data': data, 'name': name})
+        self.scene.add(item, data, name)
+
+    def remove_displayed_items(self, *names):
+        with self.scene.batch():
+            self.scene.remove(*names)
+
+            if "stl" in names:
+                self.stl_mesh = None
+                self.proxy_shown = False
+                self.selected_face_index = None
+                self.selected_patch = None
 
-    def remove_displayed_items(self, name):
-        for displayed_item in self.displayed_items:
-            if displayed_item["name"] == name:
-                self.removeItem(displayed_item['mesh'])
-                self.displayed_items.remove(displayed_item)
+            if "char" in names:
+                self.char_key = None
+                self.char_anchor = None
 
-        if name == "grid":
-            self.grid = gl.GLGridItem()
-            self.grid.setVisible(False)
-            self.set_displayed_items(self.grid, None, "grid")
+            if "grid" in names:
+                self.grid_item = None
 
-        if name == "axis":
-            self.axis = gl.GLAxisItem()
-            self.axis.setVisible(False)
-            self.set_displayed_items(self.axis, None, "axis")
+            if "axis" in names:
+                self.axis_item = None
+
+    def close_mesh(self):
+        # Removes the mesh and everything placed on it; the grid and axis are rebuilt, unscaled, with the next mesh.
+        with self.scene.batch():
+            self.remove_displayed_items(*self.scene.names("model"), *self.scene.names("selection"), "grid", "axis")
 
     def mouseMoveEvent(self, event):
         super().mouseMoveEvent(event)
+        if event.buttons() != Qt.MouseButton.NoButton:
+            self.camera_moving()
         current_center = self.cameraParams()["center"]
         self.aiming_dot.setData(pos=current_center)
 
+    def wheelEvent(self, event):
+        self.camera_moving()
+        super().wheelEvent(event)
+
+    def camera_moving(self):
+        # Large meshes are swapped for their decimated proxy while the camera moves.
+        if self.stl_mesh is None or self.stl_mesh.proxy is None or self.render_mode == "feature edges":
+            return
+        if not self.proxy_shown:
+            self.stl_mesh.mesh.setVisible(False)
+            self.stl_mesh.proxy_mesh.setVisible(True)
+            self.proxy_shown = True
+        self.idle_timer.start()
+
+    def camera_idle(self):
+        if self.proxy_shown and self.stl_mesh is not None:
+            self.stl_mesh.proxy_mesh.setVisible(False)
+            self.stl_mesh.mesh.setVisible(True)
+            self.update()
+        self.proxy_shown = False
+
     def mouseReleaseEvent(self, event):
         super().mouseReleaseEvent(event)
-        if event.button() == Qt.MouseButton.RightButton and len(
-                self.displayed_items) > 1:  # to make sure a mesh is loaded
+        if event.button() == Qt.MouseButton.RightButton and "stl" in self.scene:  # to make sure a mesh is loaded
             self.face_selection()
 
-    def show_stl(self, file_name):
-        file = Mesh(file_name)
+    def show_mesh(self, file):
+        # Displays a Mesh loaded beforehand, possibly on a worker thread (see MeshLoader).
+        self.stl_mesh = file
         self.dimensions_stl = file.get_dimensions()
-        self.set_displayed_items(file.mesh, file.data, "stl")
+        with self.scene.batch():
+            self.set_displayed_items(file.mesh, file.data, "stl")
+            if file.get_proxy() is not None:
+                file.proxy_mesh.setVisible(False)
+                self.set_displayed_items(file.proxy_mesh, None, "proxy")
         # Scale and move the grid and axis so that the mesh sits on it
         self.axis.scale(int(self.dimensions_stl["width"] / 5), int(self.dimensions_stl["length"] / 5),
                         int(self.dimensions_stl["height"] / 5))
@@ -76,41 +162,35 @@ class Viewer(gl.GLViewWidget):
                      self.dimensions_stl['height'] / np.tan(np.pi * 0.1666)]
         self.camera_distance = max(distances)
         self.setCameraParams(distance=self.camera_distance)
+        self.aiming_dot.setData(pos=self.cameraParams()["center"])
+        self.set_render_mode(self.render_mode)
+
+    def set_render_mode(self, mode):
+        self.render_mode = mode
+        if self.stl_mesh is None:
+            return
+        if mode == "feature edges" and self.stl_mesh.edge_item is None:
+            self.set_displayed_items(self.stl_mesh.edge_mesh, None, "edges")
+        if self.stl_mesh.edge_item is not None:
+            self.stl_mesh.edge_item.setVisible(mode == "feature edges")
+        self.camera_idle()
+        self.stl_mesh.mesh.setVisible(mode != "feature edges")
+        self.style_mesh_item(self.stl_mesh.mesh, mode)
+        if self.stl_mesh.proxy_item is not None:
+            self.style_mesh_item(self.stl_mesh.proxy_item, mode)
+        self.update()
+
+    @staticmethod
+    def style_mesh_item(item, mode):
+        # Only the drawing options change, the buffers already uploaded are kept (setMeshData would parse and upload
+        # the whole mesh again). Edges are only parsed by an item first drawn with them, so an item parsed in shaded
+        # mode is parsed once more for its wireframe.
+        if mode == "wireframe" and item.vertexes is not None and item.edges is None:
+            item.meshDataChanged()
+        item.opts.update(drawFaces=mode == "shaded", drawEdges=mode == "wireframe", color=(0.7, 0.7, 0.7, 1))
+        item.setShader("shaded" if mode == "shaded" else None)
 
     def face_selection(self):
-        def ray_triangle_intersection(start, direction, triangle):
-            point1, point2, point3 = triangle[0], triangle[1], triangle[2]
-
-            eps = 0.000001
-
-            edge1 = point2 - point1
-            edge2 = point3 - point1
-
-            direction = np.array([direction.x(), direction.y(), direction.z()])
-            cross_product = np.cross(direction, edge2)
-            det = edge1.dot(cross_product)
-
-            if abs(det) < eps:  # no intersection
-                return False
-
-            inverted_det = 1.0 / det
-            tvec = start - point1
-            u = tvec.dot(cross_product) * inverted_det
-
-            if u < 0.0 or u > 1.0:  # if not intersection
-                return False
-
-            qvec = np.cross(tvec, edge1)
-            v = direction.dot(qvec) * inverted_det
-            if v < 0.0 or u + v > 1.0:  # if not intersection
-                return False
-
-            t = edge2.dot(qvec) * inverted_det
-            if t < eps:
-                return False
-            self.intersection_triangle = triangle
-            return True
-
         point_of_view = self.cameraPosition()
         center = self.cameraParams()["center"]
         dir_vector_to_center = center - point_of_view
@@ -120,38 +200,27 @@ class Viewer(gl.GLViewWidget):
         # self.addItem(line)
 
         # check_for_intersection
-        face_vertexes = None
-        for mesh in self.displayed_items:
-            if mesh['name'] == "stl":
-                face_vertexes = mesh['data'].vertexes(
-                    indexed='faces')  # [ [ [ x1,y1,z1 ] , [x2,y2,z2 ] , [x3,y3,z3] ] , [x1,y1,z1] ...] ]
-                break
-
-        def check_distance(triangle):
-            distance = min(
-                [np.linalg.norm(self.cameraPosition() - triangle[0]),
-                 np.linalg.norm(self.cameraPosition() - triangle[1]),
-                 np.linalg.norm(self.cameraPosition() - triangle[2])])
-            return distance
-
-        distances = []
-        index = 0
-        for face_vertex in face_vertexes:  # Browse from bottom to top
-            if ray_triangle_intersection(point_of_view, dir_vector_to_center, face_vertex):
-                distances.append([check_distance(face_vertex), face_vertex])
-            index += 1
-
-        def select_face(face, color):
-            data = gl.MeshData(vertexes=np.array(face), faces=[[0, 1, 2]])
+        if self.stl_mesh is None:
+            return
+        face_vertexes = self.stl_mesh.triangles  # [ [ [ x1,y1,z1 ] , [x2,y2,z2 ] , [x3,y3,z3] ] , [x1,y1,z1] ...] ]
+        # The mesh is centered by its transform: the ray is moved into file coordinates, and only the triangles whose
+        # leaf boxes it crosses are tested.
+        start = np.array([point_of_view.x(), point_of_view.y(), point_of_view.z()]) - self.stl_mesh.offset
+        direction = [dir_vector_to_center.x(), dir_vector_to_center.y(), dir_vector_to_center.z()]
+        candidates = self.stl_mesh.get_bvh().intersect(start, direction)
+        closest, _ = closest_intersection(start, direction, face_vertexes[candidates])
+
+        def select_face(faces, color):
+            data = gl.MeshData(vertexes=np.asarray(faces, dtype=np.float32))
             face_mesh = gl.GLMeshItem(meshdata=data, smooth=False, drawFaces=True, color=color)
-            self.remove_displayed_items("face")
             self.set_displayed_items(face_mesh, data, "face")
 
-        if len(distances) > 0:  # if there is an intersection
-            closest = min(distances, key=lambda x: x[0])  # distance = [ distance, face_vertex ]
-            selected_face = closest[1]
-            select_face(selected_face, (0, 0, 1, 1))
-            self.rotate_camera(selected_face)
+        if closest is not None:  # if there is an intersection
+            self.selected_face_index = int(candidates[closest])
+            # The whole flat region around the picked triangle is highlighted and the serial number is laid out on it.
+            self.selected_patch = self.stl_mesh.select_patch(self.selected_face_index)
+            select_face(face_vertexes[self.selected_patch["faces"]] + self.stl_mesh.offset, (0, 0, 1, 1))
+            self.rotate_camera(face_vertexes[self.selected_face_index] + self.stl_mesh.offset)
 
     def rotate_camera(self, face):  # TODO fix weird rotation on some vertical faces.
         # Getting the center of the face to align it with the center of rotation of the camera.
@@ -170,112 +239,91 @@ class Viewer(gl.GLViewWidget):
         final_azimuth = np.sign(y) * np.arccos(x / np.sqrt(x ** 2 + y ** 2))
         final_elevation, final_azimuth = np.rad2deg(final_elevation), np.rad2deg(final_azimuth)
 
-        # Smoothing camera's movement
+        # Smoothing camera's movement: the animation is driven by elapsed time, so it lasts the same whatever the
+        # frame rate, and a new pick restarts it from wherever the camera currently is.
+        self.camera_animation.stop()
         current_camera_parameters = self.cameraParams()
         current_elevation, current_azimuth = current_camera_parameters["elevation"], current_camera_parameters[
             "azimuth"]
-        elevation_travel = np.linspace(current_elevation, final_elevation, 50)
         if abs(final_azimuth - current_azimuth) > 180:
             if final_azimuth > current_azimuth:
                 final_azimuth -= 360
             else:
                 final_azimuth += 360
-        azimuth_travel = np.linspace(current_azimuth, final_azimuth, 50)
-        distance_travel = np.linspace(current_camera_parameters["distance"], self.camera_distance, 50)
-        center_x_travel = np.linspace(current_camera_parameters["center"][0], center.x(), 50)
-        center_y_travel = np.linspace(current_camera_parameters["center"][1], center.y(), 50)
-        center_z_travel = np.linspace(current_camera_parameters["center"][2], center.z(), 50)
-
-        for elevation, azimuth, distance, center_x, center_y, center_z in zip(elevation_travel, azimuth_travel,
-                                                                              distance_travel, center_x_travel,
-                                                                              center_y_travel, center_z_travel):
-            self.setCameraParams(elevation=elevation, azimuth=azimuth, distance=distance,
-                                 center=Vector(center_x, center_y, center_z))
-            self.update()
-            QTest.qWait(10)
-
-    def show_char(self, files):
-
-        def angle_from_vectors(vector1, vector2):
-            normalized_vector1, normalized_vector2 = (vector1 / np.linalg.norm(vector1)).reshape(3), (
-                    vector2 / np.linalg.norm(vector2)).reshape(3)
-            cross_product = np.cross(normalized_vector1, normalized_vector2)
-            if any(cross_product):  # in case the two vectors are collinear
-                dot_product = np.dot(normalized_vector1, normalized_vector2)
-                normalized_cross_product = np.linalg.norm(cross_product)
-                result = np.array([[0, -cross_product[2], cross_product[1]], [cross_product[2], 0, -cross_product[0]],
-                                   [-cross_product[1], cross_product[0], 0]])
-                rotation_matrix = np.eye(3) + result + result.dot(result) * (
-                        (1 - dot_product) / (normalized_cross_product ** 2))
-                collinear = False
-            else:
-                rotation_matrix = np.eye(3)
-                collinear = True
-
-            r11, r12, r13 = rotation_matrix[0]
-            r21, r22, r23 = rotation_matrix[1]
-            r31, r32, r33 = rotation_matrix[2]
-
-            if r33 != 0:  # Those are only useful in case of perpendicular vectors.
-                x_angle = np.arctan(-r23 / r33)
-                y_angle = np.arctan(r13 * np.cos(x_angle) / r33)
-            else:
-                x_angle = np.arctan(copysign(1, -r23) * np.inf)  # copysign(1,x) returns the sign of x
-                y_angle = np.arctan(copysign(1, r13 * np.cos(x_angle)) * np.inf)
-            if r11 != 0:
-                z_angle = np.arctan(-r12 / r11)
-            else:
-                z_angle = np.arctan(copysign(1, -r12) * np.inf)
-
-            x_angle = x_angle * 180 / np.pi
-            y_angle = y_angle * 180 / np.pi
-            z_angle = z_angle * 180 / np.pi
-
-            angles = [x_angle, y_angle, z_angle]
-            return angles, collinear
-
-        normal, face_center = QVector3D(0, 0, 0), np.array(3)
-        for item in self.displayed_items:
-            if item["name"] == "face":
-                face = item['mesh'].vertexes[0]
-                face_center = (face[0] + face[1] + face[2]) / 3
-                normal = np.cross(face[1] - face[0], face[2] - face[0])
-                normal = QVector3D(normal[0], normal[1], normal[2])
-                normal.normalize()
-                break
-        angles, collinear = angle_from_vectors(np.array([0, 0, 1]), np.array([normal.x(), normal.y(), normal.z()]))
-        if not collinear:  # if selected face is not parallel to the grid
-            writing_direction = QVector3D.crossProduct(normal, QVector3D(0, 0, 1))
+        current_center = current_camera_parameters["center"]
+        self.camera_travel = (np.array([current_elevation, current_azimuth, current_camera_parameters["distance"],
+                                        current_center[0], current_center[1], current_center[2]]),
+                              np.array([final_elevation, final_azimuth, self.camera_distance,
+                                        center.x(), center.y(), center.z()]))
+        self.camera_animation.start()
+
+    def animate_camera(self, progress):
+        start, end = self.camera_travel
+        elevation, azimuth, distance, center_x, center_y, center_z = start + (end - start) * progress
+        self.setCameraParams(elevation=elevation, azimuth=azimuth, distance=distance,
+                             center=Vector(center_x, center_y, center_z))
+        self.camera_moving()
+        self.aiming_dot.setData(pos=self.cameraParams()["center"])
+        self.update()
+
+    def show_char(self, text, range_texts=None):
+        # range_texts: every text of the serial range text belongs to; fitted text is then sized for the widest one,
+        # as the exported parts are (see Serializer.fit_range).
+        if self.selected_patch is None:
+            return
+        layout = self.get_text_layout().layout(text)
+        extent = None
+        if self.fit_to_face and range_texts:
+            extent = self.get_text_layout().extent(range_texts)
+        char_key = (text, self.selected_face_index, self.fit_to_face, self.glyph_cache.generation,
+                    None if extent is None else tuple(extent))
+        if char_key == self.char_key:  # same text on the same face, nothing to rebuild
+            return
+        patch = self.selected_patch
+
+        # The whole string is one vertex buffer in text space, centered on its bounds; the item's transform puts it
+        # on the face (see Geometry.text_frame) and carries the user's rotation and translation.
+        if self.fit_to_face:
+            scale, origin = fit_text(layout["minimum"], layout["maximum"], patch, extent=extent)
         else:
-            writing_direction = QVector3D(1, 0, 0)
-
-        for file_number in range(
-                len(files)):  # opening the mesh, moving it to the center of the face, and rotating it to align with it.
-            file_name = files[file_number]
-            if file_name != "space" and file_name != "*":
-                file = Mesh(file_name, char=True)
-                file.mesh.setColor(QColor(255, 0, 0))
-                file_volume = self.dimensions_stl["width"] * self.dimensions_stl["length"] * self.dimensions_stl[
-                    "height"]
-                file_volume = file_volume ** 0.33
-                file.mesh.scale(file_volume / 100, file_volume / 100, file_volume / 100)
-                distance_between_char = (-len(files) + 1 + (int(len(files) - 1)) + file_number) * file_volume / 10
-                file.mesh.translate(face_center[0] + int(writing_direction[0] * distance_between_char),
-                                    face_center[1] + int(writing_direction[1] * distance_between_char), face_center[2])
-                file.mesh.rotate(90, 1, 0, 0, local=True)  # fixes initial orientation
-                file.mesh.rotate(angles[0], 1, 0, 0, local=True)
-                file.mesh.rotate(angles[1], 0, 1, 0, local=True)
-                file.mesh.rotate(angles[2], 0, 0, 1, local=True)
-                self.set_displayed_items(file.mesh, file.data, "char")
-
-    def rotate_char(self, axis, angle):
-        for item in self.displayed_items:
-            if item["name"] == "char":
-                item["mesh"].rotate(angle, axis[0], axis[1], axis[2],local = True)
-                self.update()
-
-    def translate_char(self, axis, distance):
-        for item in self.displayed_items:
-            if item["name"] == "char":
-                item["mesh"].translate(axis[0] * distance, axis[1] * distance, axis[2] * distance)
-                self.update()
+            scale = part_text_scale(self.dimensions_stl)
+            origin = text_origin(layout["minimum"], layout["maximum"], scale, patch["centroid"], patch["axes"])
+        frame = text_frame(layout["minimum"], layout["maximum"], origin + self.stl_mesh.offset, patch["normal"], scale,
+                           patch["axes"][0])
+        center = (layout["minimum"] + layout["maximum"]) / 2
+        triangles = place_glyphs(layout["glyphs"], text_transforms(layout["offsets"] - center))
+        adjustment = self.char_transform()  # the operator's rotation and translation carry over to the new text
+        with self.scene.batch():
+            self.remove_displayed_items("char")
+            if not len(triangles):
+                return
+            data = gl.MeshData(vertexes=triangles)
+            char_mesh = gl.GLMeshItem(meshdata=data, smooth=False, drawFaces=False, drawEdges=True,
+                                      edgeColor=(1, 0, 0, 1))
+            char_mesh.setColor(QColor(255, 0, 0))
+            char_mesh.setTransform(frame if adjustment is None else frame @ adjustment)
+            self.set_displayed_items(char_mesh, data, "char")
+            self.char_key = char_key
+            self.char_anchor = frame
+
+    def transform_char(self, rotation, translation):
+        # rotation: angles in degrees around the string's own axes, x along the text, y up the text and z out of the
+        # face (so z spins the text within the face), about its center; translation: along the scene axes. The
+        # item's transform maps text space, where up is +z and the face normal is -y.
+        char_mesh = self.scene.mesh("char")
+        if char_mesh is None:
+            return
+        matrix = np.array(char_mesh.transform().copyDataTo()).reshape(4, 4)
+        matrix = matrix @ rotation_matrix(rotation[0], 1, 0, 0) @ rotation_matrix(rotation[1], 0, 0, 1) \
+            @ rotation_matrix(rotation[2], 0, -1, 0)
+        matrix[:3, 3] += translation
+        char_mesh.setTransform(matrix)
+        self.update()
+
+    def char_transform(self):
+        # The operator's rotation and translation of the displayed serial number, as a 4x4 matrix in its text space
+        # (None when nothing is displayed); the Serializer applies it in each exported number's text space.
+        char_mesh = self.scene.mesh("char")
+        if char_mesh is None:
+            return None
+        return np.linalg.inv(self.char_anchor) @ np.array(char_mesh.transform().copyDataTo()).reshape(4, 4)
@@ -0,0 +1,277 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import pyqtgraph.opengl as gl
+import stl
+
+from BVH import BVH
+from combining_stl import STL_HEADER, STL_RECORD, combine
+from EdgeIndex import EdgeIndex
+from Geometry import MeshGeometry, closest_intersection, face_frame, feature_edges, layout_transforms, load_stl, \
+    part_text_scale, place_glyphs, placement_frame, text_origin, weld_vertexes
+from GlyphCache import GlyphCache
+from Mesh import Mesh
+from TextLayout import TextLayout
+
+SERIAL_TEXT = "SN-0001234"
+
+
+class LegacyMesh(Mesh):
+    # The original numpy-stl loader with loop based bounds and centering, kept as the reference the current path is
+    # measured against.
+    def __init__(self, file_name, char=False):
+        self.file = stl.mesh.Mesh.from_file(file_name)
+        self.char = char
+        self.mesh_data = self.convert_data()
+        self.item = self.convert_to_stl()
+        self.center_mesh()
+
+    def convert_data(self):
+        points = self.file.points.reshape(-1, 3)
+        faces = np.arange(points.shape[0]).reshape(-1, 3)
+        return gl.MeshData(faces=faces, vertexes=points)
+
+    def get_dimensions(self):
+        minx = maxx = miny = maxy = minz = maxz = None
+        for point in self.file.points:
+            if minx is None:
+                minx = point[stl.Dimension.X]
+                maxx = point[stl.Dimension.X]
+                miny = point[stl.Dimension.Y]
+                maxy = point[stl.Dimension.Y]
+                minz = point[stl.Dimension.Z]
+                maxz = point[stl.Dimension.Z]
+            else:
+                maxx = max(point[stl.Dimension.X], maxx)
+                minx = min(point[stl.Dimension.X], minx)
+                maxy = max(point[stl.Dimension.Y], maxy)
+                miny = min(point[stl.Dimension.Y], miny)
+                maxz = max(point[stl.Dimension.Z], maxz)
+                minz = min(point[stl.Dimension.Z], minz)
+
+        dimensions = {"width": maxx - minx,
+                      "length": maxy - miny,
+                      "height": maxz - minz,
+                      "minx": minx,
+                      "maxx": maxx,
+                      "miny": miny,
+                      "maxy": maxy,
+                      "minz": minz,
+                      "maxz": maxz}
+        return dimensions
+
+    def center_mesh(self):
+        dimensions = self.get_dimensions()
+        dx = -dimensions["minx"] - (dimensions["width"] / 2)
+        dy = -dimensions["miny"] - (dimensions["length"] / 2)
+        dz = -dimensions["minz"] - (dimensions["height"] / 2)
+        vertexes = []
+        for vertex in self.data.vertexes():
+            vertex[0] += dx
+            vertex[1] += dy
+            vertex[2] += dz
+            vertexes.append(vertex)
+        faces = np.arange(np.array(vertexes).shape[0]).reshape(-1, 3)
+        self.mesh.setMeshData(meshdata=gl.MeshData(faces=faces, vertexes=vertexes))
+
+
+def write_synthetic_stl(file_name, triangles, chunk_size=1000000):
+    # A UV sphere of radius 50 cut into the requested number of small triangles, written chunk by chunk so that even
+    # 10M triangles never sit in memory at once. Unlike random triangles, it has the locality of a real part.
+    rows = max(2, int(np.sqrt(triangles / 4)))
+    columns = max(3, -(-triangles // (2 * rows)))
+    with open(file_name, "wb") as file:
+        file.write(STL_HEADER.ljust(80, b" "))
+        file.write(np.uint32(triangles).tobytes())
+        for start in range(0, triangles, chunk_size):
+            index = np.arange(start, min(start + chunk_size, triangles))
+            row, column = divmod(index // 2, columns)
+            theta = np.pi * np.stack((row, row + 1)) / rows
+            phi = 2 * np.pi * np.stack((column, column + 1)) / columns
+
+            def corner(i, j):
+                return 50 * np.stack((np.sin(theta[i]) * np.cos(phi[j]), np.sin(theta[i]) * np.sin(phi[j]),
+                                      np.cos(theta[i])), axis=1)
+
+            upper = (index % 2 == 1)[:, None, None]
+            lower_triangles = np.stack((corner(0, 0), corner(1, 0), corner(1, 1)), axis=1)
+            upper_triangles = np.stack((corner(0, 0), corner(1, 1), corner(0, 1)), axis=1)
+            records = np.zeros(len(index), dtype=STL_RECORD)
+            records["vectors"] = np.where(upper, upper_triangles, lower_triangles)
+            file.write(records.tobytes())
+
+
+def load_to_display(mesh_class, file_name):
+    start = time.perf_counter()
+    mesh = mesh_class(file_name)
+    mesh.get_dimensions()
+    return time.perf_counter() - start
+
+
+def best_time(function, repeat):
+    # Best of repeat runs: files are in the page cache after the first one, so these are warm timings.
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def ray_origins(count, distance=200):
+    rng = np.random.default_rng(0)
+    directions = rng.normal(size=(count, 3))
+    return directions / np.linalg.norm(directions, axis=1, keepdims=True) * distance
+
+
+def geometry_stages(file_name, repeat, rays, output_directory):
+    # Headless stages, NumPy only.
+    results = {}
+    results["parse"] = best_time(lambda: np.array(load_stl(file_name)["vectors"]), repeat)
+    triangles = np.array(load_stl(file_name)["vectors"])
+    results["bounds"] = best_time(lambda: (triangles.min(axis=(0, 1)), triangles.max(axis=(0, 1))), repeat)
+    results["load"] = best_time(lambda: MeshGeometry(file_name), repeat)
+    geometry = MeshGeometry(file_name)
+    results["centering"] = best_time(lambda: (geometry.center_mesh(), geometry.transform()), repeat)
+    results["bvh"] = best_time(lambda: BVH(geometry.triangles), repeat)
+    vertexes, faces = weld_vertexes(geometry.triangles)
+    results["edge index"] = best_time(lambda: EdgeIndex(vertexes, faces).adjacency(), repeat)
+    results["feature edges"] = best_time(lambda: feature_edges(geometry.get_edge_index(), geometry.get_normals()),
+                                         repeat)
+
+    bvh = geometry.get_bvh()
+    origins = ray_origins(rays)
+    faces = []
+
+    def pick():
+        faces.clear()
+        for origin in origins:
+            candidates = bvh.intersect(origin, -origin)
+            closest, _ = closest_intersection(origin, -origin, geometry.triangles[candidates])
+            faces.append(None if closest is None else int(candidates[closest]))
+
+    results["pick (per ray)"] = best_time(pick, repeat) / rays
+
+    text_layout = TextLayout(GlyphCache())
+    center, normal = face_frame(geometry.triangles[next(face for face in faces if face is not None)])
+    scale = part_text_scale(geometry.get_dimensions())
+
+    def place():
+        layout = text_layout.layout(SERIAL_TEXT)
+        origin = text_origin(layout["minimum"], layout["maximum"], scale, center, placement_frame(normal))
+        return place_glyphs(layout["glyphs"], layout_transforms(origin, normal, layout["offsets"], scale))
+
+    results["place"] = best_time(place, repeat)
+    serial = place()
+    export_name = os.path.join(output_directory, "export.stl")
+    results["export"] = best_time(lambda: combine(export_name, geometry.records, serial), repeat)
+    return results
+
+
+def viewer_stages(file_name, repeat):
+    # The viewer's own code paths, on an offscreen Qt platform when there is no display. Without a GL context
+    # nothing is drawn, but everything up to the GL upload runs.
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt6.QtWidgets import QApplication
+    from Viewer import Viewer
+
+    application = QApplication.instance() or QApplication([])
+    viewer = Viewer()
+    results = {}
+    meshes = []
+
+    def display():
+        viewer.close_mesh()
+        meshes.append(Mesh(file_name))
+        meshes[-1].get_bvh()
+        viewer.show_mesh(meshes[-1])
+
+    results["display"] = best_time(display, repeat)
+
+    def face_selection():
+        viewer.setCameraParams(elevation=20, azimuth=30, distance=viewer.camera_distance)
+        viewer.face_selection()
+        viewer.camera_animation.stop()
+
+    results["face_selection"] = best_time(face_selection, repeat)
+
+    def show_char():
+        viewer.char_key = None
+        viewer.show_char(SERIAL_TEXT)
+
+    results["show_char"] = best_time(show_char, repeat) if "face" in viewer.scene else None
+    viewer.close_mesh()
+    application.processEvents()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous_file):
+    with open(previous_file) as file:
+        previous = {(entry["triangles"], entry["stage"]): entry["seconds"] for entry in json.load(file)["results"]}
+    print(f"\n{'triangles':>10} {'stage':<16} {'before (s)':>12} {'now (s)':>12} {'ratio':>7}")
+    for entry in results:
+        before = previous.get((entry["triangles"], entry["stage"]))
+        if before and entry["seconds"]:
+            print(f"{entry['triangles']:>10} {entry['stage']:<16} {before:>12.6f} {entry['seconds']:>12.6f} "
+                  f"{entry['seconds'] / before:>6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times loading, picking, glyph placement and export on synthetic "
+                                                 "STLs and writes the results as JSON.")
+    parser.add_argument("--triangles", type=int, nargs="+", default=[10000, 100000, 1000000, 10000000])
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the best one is kept")
+    parser.add_argument("--rays", type=int, default=100, help="rays cast by the pick stage")
+    parser.add_argument("--no-viewer", action="store_true", help="skip the stages that need Qt")
+    parser.add_argument("--skip-legacy-above", type=int, default=100000,
+                        help="do not run the original implementation above this triangle count")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", help="results of an earlier run to compare against")
+    arguments = parser.parse_args()
+
+    results = []
+    print(f"{'triangles':>10} {'stage':<16} {'seconds':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        for triangles in arguments.triangles:
+            file_name = os.path.join(directory, f"{triangles}.stl")
+            write_synthetic_stl(file_name, triangles)
+            stages = geometry_stages(file_name, arguments.repeat, arguments.rays, directory)
+            if not arguments.no_viewer:
+                stages.update(viewer_stages(file_name, arguments.repeat))
+            if triangles <= arguments.skip_legacy_above:
+                stages["legacy load"] = load_to_display(LegacyMesh, file_name)
+            for stage, seconds in stages.items():
+                results.append({"triangles": triangles, "stage": stage, "seconds": seconds})
+                print(f"{triangles:>10} {stage:<16} {'-' if seconds is None else f'{seconds:.6f}':>12}")
+            os.remove(file_name)
+
+    report = {"commit": git_commit(),
+              "python": platform.python_version(),
+              "numpy": np.__version__,
+              "platform": platform.platform(),
+              "cpu_count": os.cpu_count(),
+              "repeat": arguments.repeat,
+              "results": results}
+    with open(arguments.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"results written to {arguments.output}")
+    if arguments.compare:
+        compare(results, arguments.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+import argparse
+
+from GlyphCache import ATLAS_FILE, GLYPH_DIRECTORY, GlyphCache, write_atlas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Packs every glyph STL into a single memory-mappable atlas.")
+    parser.add_argument("--directory", default=GLYPH_DIRECTORY)
+    parser.add_argument("--output", default=ATLAS_FILE)
+    arguments = parser.parse_args()
+
+    cache = GlyphCache(arguments.directory, atlas=None, preload=True)
+    size = write_atlas(cache.glyphs, arguments.output)
+    print(f"{len(cache.glyphs)} glyphs packed into {arguments.output} ({size / 1e6:.2f} MB)")
+
+
+if __name__ == '__main__':
+    main()
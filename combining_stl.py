@@ -1,9 +1,50 @@
-import stl
-import numpy
+import time
 
-ball = stl.mesh.Mesh.from_file('STL_Characters/Ball.stl')
-cube = stl.mesh.Mesh.from_file('STL_Characters/Cube.stl')
+import numpy as np
 
-def combine(object1,object2):
-    combined = stl.mesh.Mesh(numpy.concatenate([object1.data, object2.data]))
-    combined.save('combined.stl', mode=stl.Mode.ASCII)
\ No newline at end of file
+# One binary STL triangle record: normal, three vertexes and the attribute byte count, 50 bytes without padding.
+STL_RECORD = np.dtype([("normals", "<f4", (3,)), ("vectors", "<f4", (3, 3)), ("attr", "<u2")])
+STL_HEADER = b"MeshCataloger binary STL"
+
+
+def as_array(part):
+    return part if isinstance(part, np.ndarray) else part.data  # numpy-stl meshes keep their records in .data
+
+
+def part_chunks(part, chunk_size):
+    # Yields the part as bytes of binary STL records, chunk_size triangles at a time. Parts can be numpy-stl meshes,
+    # record arrays or (F, 3, 3) triangle arrays; record arrays are written straight from their buffer.
+    if part.dtype.names is not None and part.dtype.itemsize == STL_RECORD.itemsize:
+        for start in range(0, len(part), chunk_size):
+            yield part[start:start + chunk_size].tobytes()
+        return
+
+    records = np.zeros(min(chunk_size, len(part)), dtype=STL_RECORD)
+    for start in range(0, len(part), chunk_size):
+        triangles = part[start:start + chunk_size]
+        chunk = records[:len(triangles)]
+        chunk["vectors"] = triangles
+        normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+        chunk["normals"] = normals / np.where(lengths > 0, lengths, 1)
+        yield chunk.tobytes()
+
+
+def combine(output_path, *parts, chunk_size=65536):
+    # Writes every part, one after the other, into a single binary STL without concatenating them in memory first.
+    start = time.perf_counter()
+    parts = [as_array(part) for part in parts]
+    triangle_count = sum(len(part) for part in parts)
+    written = 0
+    with open(output_path, "wb") as file:
+        written += file.write(STL_HEADER.ljust(80, b" "))
+        written += file.write(np.uint32(triangle_count).tobytes())
+        for part in parts:
+            for chunk in part_chunks(part, chunk_size):
+                written += file.write(chunk)
+    duration = time.perf_counter() - start
+    return {"path": output_path,
+            "triangles": triangle_count,
+            "bytes": written,
+            "seconds": duration,
+            "bytes_per_second": written / duration if duration > 0 else float("inf")}
@@ -1,12 +1,31 @@
 import sys
+import time
 from pathlib import Path
 
+startup_marks = [("start", time.perf_counter())]  # (phase, time at its end), printed with --profile-startup
+
 from PyQt6.QtCore import Qt
 from PyQt6.QtWidgets import QApplication, QMainWindow, QPushButton, QVBoxLayout, QHBoxLayout, QGridLayout, QWidget, \
-    QFileDialog, QLabel, QLineEdit, QSplitter, QDoubleSpinBox
+    QFileDialog, QLabel, QLineEdit, QSplitter, QDoubleSpinBox, QCheckBox, QComboBox
+
+startup_marks.append(("import Qt", time.perf_counter()))
 
+from MeshLoader import MeshLoader
 from Viewer import Viewer
 
+startup_marks.append(("import viewer", time.perf_counter()))
+
+
+def mark_startup(phase):
+    startup_marks.append((phase, time.perf_counter()))
+
+
+def print_startup_profile():
+    print(f"{'startup phase':<16} {'ms':>8} {'total ms':>9}", file=sys.stderr)
+    for (_, previous), (phase, end) in zip(startup_marks, startup_marks[1:]):
+        print(f"{phase:<16} {(end - previous) * 1000:>8.1f} {(end - startup_marks[0][1]) * 1000:>9.1f}",
+              file=sys.stderr)
+
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -16,10 +35,17 @@ class MainWindow(QMainWindow):
         self.text = QLabel()
         self.file_name = QLabel()
         self.load_button = QPushButton()
+        self.weld_check_box = QCheckBox()
+        self.fit_check_box = QCheckBox()
+        self.render_mode_box = QComboBox()
         self.text_input = QLineEdit()
         self.first_part_number = QDoubleSpinBox()
         self.last_part_number = QDoubleSpinBox()
         self.apply_number_button = QPushButton()
+        self.export_button = QPushButton()
+        self.export_worker = None
+        self.mesh_file = None
+        self.mesh_loader = None
         self.right_layout = QVBoxLayout()
         self.rotation_layout = QHBoxLayout()
         self.translate_layout = QHBoxLayout()
@@ -60,6 +86,7 @@ class MainWindow(QMainWindow):
 
         self.first_part_number.setMaximum(9999)
         self.first_part_number.setDecimals(0)
+        self.first_part_number.valueChanged.connect(self.refresh_char)
         upper_grid_layout.addWidget(self.first_part_number, 1, 0)
 
         last_part_instruction = QLabel("Last part number")
@@ -67,7 +94,17 @@ class MainWindow(QMainWindow):
 
         self.last_part_number.setMaximum(10000)
         self.last_part_number.setDecimals(0)
+        self.last_part_number.valueChanged.connect(self.refresh_char)
         upper_grid_layout.addWidget(self.last_part_number, 1, 1)
+
+        self.export_button.setText("Export serial range")
+        self.export_button.clicked.connect(self.clicked_export_range)
+        upper_grid_layout.addWidget(self.export_button, 2, 0, 1, 2)
+
+        self.fit_check_box.setText("Fit serial number to face")
+        self.fit_check_box.setChecked(self.mesh_viewer.fit_to_face)
+        self.fit_check_box.toggled.connect(self.toggled_fit_to_face)
+        upper_grid_layout.addWidget(self.fit_check_box, 3, 0, 1, 2)
         self.right_layout.insertLayout(2, upper_grid_layout)
 
         self.apply_number_button.setText("Apply serial number")
@@ -83,7 +120,12 @@ class MainWindow(QMainWindow):
         layout = QHBoxLayout()
         self.load_button.clicked.connect(self.clicked_open_file)
         self.text.setText("Please select a file")
+        self.weld_check_box.setText("Weld vertices")
         layout.addWidget(self.text)
+        layout.addWidget(self.weld_check_box)
+        self.render_mode_box.addItems(["Wireframe", "Feature edges", "Shaded"])
+        self.render_mode_box.currentTextChanged.connect(lambda mode: self.mesh_viewer.set_render_mode(mode.lower()))
+        layout.addWidget(self.render_mode_box)
         layout.addWidget(self.load_button)
         return layout
 
@@ -91,54 +133,138 @@ class MainWindow(QMainWindow):
         home_directory = str(Path.home())
         data = QFileDialog.getOpenFileName(self, 'Open file', home_directory, filter="*.stl")
         file_name = data[0]
+        if not file_name:
+            return
+        self.mesh_file = file_name
         self.file_name.setText(file_name[-20:])
-        self.mesh_viewer.show_stl(file_name)
+        # The window owns the loader, so a cancelled one that is still winding down is not destroyed under its
+        # thread when the next file is opened; it deletes itself once finished.
+        self.mesh_loader = MeshLoader(file_name, weld=0.00001 if self.weld_check_box.isChecked() else None,
+                                      parent=self)
+        self.mesh_loader.finished.connect(self.mesh_loader.deleteLater)
+        self.mesh_loader.progress.connect(self.loading_progress)
+        self.mesh_loader.loaded.connect(self.mesh_loaded)
+        self.mesh_loader.failed.connect(self.loading_failed)
+        self.text.setText("Loading...")
+        self.load_button.setText("Cancel loading")
+        self.load_button.disconnect()
+        self.load_button.clicked.connect(self.clicked_cancel_loading)
+        self.mesh_loader.start()
+
+    def loading_progress(self, bytes_read, triangles):
+        if self.sender() is not self.mesh_loader:  # queued by a cancelled load
+            return
+        self.text.setText(f"Loading... {bytes_read / 1e6:.1f} MB, {triangles} triangles")
+
+    def mesh_loaded(self, mesh):
+        if self.sender() is not self.mesh_loader:  # from a load cancelled while its result was queued
+            return
+        self.mesh_loader = None
+        self.mesh_viewer.show_mesh(mesh)
         self.mesh_viewer.grid.setVisible(True)
         self.mesh_viewer.axis.setVisible(True)
+        # The load statistics go in the tooltip, so the status line stays short and does not widen the window.
+        bvh = self.mesh_viewer.stl_mesh.get_bvh()
+        edge_index = self.mesh_viewer.stl_mesh.get_edge_index()
+        stats = [f"Search tree of {bvh.triangle_count} triangles built in {bvh.build_time * 1000:.0f} ms",
+                 f"Edge index of {edge_index.edge_count} edges ({edge_index.nbytes() / 1e6:.1f} MB) built in "
+                 f"{edge_index.build_time * 1000:.0f} ms"]
+        weld_stats = self.mesh_viewer.stl_mesh.weld_stats
+        if weld_stats is not None:
+            stats.append(f"Welded {weld_stats['vertexes_before']} to {weld_stats['vertexes_after']} vertices, "
+                         f"{1 - weld_stats['bytes_after'] / weld_stats['bytes_before']:.0%} less memory")
         self.text.setText("Select a face ( aim + right click )")
+        self.text.setToolTip("\n".join(stats))
         self.load_button.setText("Close file")
         self.load_button.disconnect()
         self.load_button.clicked.connect(self.clicked_close_file)
 
-    def clicked_close_file(self):
-        while len(self.mesh_viewer.displayed_items) >= 4:
-            self.mesh_viewer.remove_displayed_items("stl")
-            self.mesh_viewer.remove_displayed_items("face")
-            self.mesh_viewer.remove_displayed_items("char")
-            self.mesh_viewer.remove_displayed_items("grid")
-            self.mesh_viewer.remove_displayed_items("axis")
-        self.mesh_viewer.setCameraParams(center=self.mesh_viewer.center)
+    def loading_failed(self, error):
+        if self.sender() is not self.mesh_loader:
+            return
+        self.mesh_loader = None
+        self.reset_load_button()
+        self.text.setText(f"Could not load the file: {error}")
+
+    def clicked_cancel_loading(self):
+        self.mesh_loader.requestInterruption()
+        self.mesh_loader = None
+        self.reset_load_button()
+
+    def reset_load_button(self):
         self.load_button.disconnect()
         self.load_button.clicked.connect(self.clicked_open_file)
         self.load_button.setText("Load file")
         self.file_name.setText("")
+        self.mesh_file = None
         self.text.setText("Please select a file")
+        self.text.setToolTip("")
+
+    def clicked_close_file(self):
+        self.mesh_viewer.close_mesh()
+        self.mesh_viewer.setCameraParams(center=self.mesh_viewer.center)
+        self.reset_load_button()
         self.hide_transformation_layout()
 
     def clicked_apply_number(self):
-        files = []  # files = ["p.stl","a.stl","r.stl","t.stl"]
-
-        for letter in self.text_input.text():
-            if letter == "*":
-                stl_char_file = "*"
-                files.append(stl_char_file)
-
-            elif letter == " ":
-                files.append("space")
-
-            elif letter.isdigit():
-                files.append("STL_Characters/" + letter + ".stl")
-
-            else:
-                if letter.islower():
-                    stl_char_file = "STL_Characters/" + "lower_" + letter + ".stl"
-
-                else:
-                    stl_char_file = "STL_Characters/" + "upper_" + letter + ".stl"
-                files.append(stl_char_file)
         if self.right_layout.layout().count() < 6:
             self.show_transformation_layout()
-        self.mesh_viewer.show_char(files)
+        self.mesh_viewer.get_glyph_cache().check_directory()  # once per Apply, not once per layout
+        self.mesh_viewer.show_char(self.preview_text(), self.serial_texts())
+
+    def preview_text(self):
+        # The text of the first part of the range, fitted and placed exactly as that part is exported.
+        return (self.text_input.text() or "*").replace("*", str(int(self.first_part_number.value())))
+
+    def serial_texts(self):
+        # Every text of the range, as the export fills them in; the whole range is marked at one size.
+        text_format = self.text_input.text() or "*"
+        return [text_format.replace("*", str(number))
+                for number in range(int(self.first_part_number.value()), int(self.last_part_number.value()) + 1)]
+
+    def refresh_char(self):
+        if "char" in self.mesh_viewer.scene:
+            self.mesh_viewer.show_char(self.preview_text(), self.serial_texts())
+
+    def toggled_fit_to_face(self, checked):
+        self.mesh_viewer.fit_to_face = checked
+        self.refresh_char()
+
+    def clicked_export_range(self):
+        if self.mesh_file is None or self.mesh_viewer.selected_face_index is None:
+            self.text.setText("Load a file and select a face before exporting")
+            return
+        if self.first_part_number.value() > self.last_part_number.value():
+            self.text.setText("The first part number is after the last one")
+            return
+        output_directory = QFileDialog.getExistingDirectory(self, 'Export directory', str(Path.home()))
+        if not output_directory:
+            return
+        from ExportWorker import ExportWorker  # the process pool machinery is only imported for the first export
+
+        self.export_worker = ExportWorker(self.mesh_file, self.mesh_viewer.selected_face_index,
+                                          self.text_input.text() or "*", int(self.first_part_number.value()),
+                                          int(self.last_part_number.value()), output_directory,
+                                          self.mesh_viewer.fit_to_face, self.mesh_viewer.char_transform())
+        self.export_worker.progress.connect(self.export_progress)
+        self.export_worker.finished.connect(self.export_finished)
+        self.export_button.setEnabled(False)
+        self.text.setText("Exporting...")
+        self.export_worker.start()
+
+    def export_progress(self, done, total):
+        self.text.setText(f"Exported {done} / {total} parts")
+
+    def export_finished(self):
+        worker = self.export_worker
+        if worker.error is not None:
+            self.text.setText(f"Export failed: {worker.error}")
+        elif not worker.file_names:
+            self.text.setText("No parts were exported")
+        else:
+            self.text.setText(f"Exported {len(worker.file_names)} parts to {worker.output_directory} in "
+                              f"{worker.duration:.1f} s ({len(worker.file_names) / worker.duration:.1f} parts/s)")
+        self.export_button.setEnabled(True)
 
     def show_transformation_layout(self):
         x_label, y_label, z_label = QLabel("X:"), QLabel("Y:"), QLabel("Z:")
@@ -181,6 +307,8 @@ class MainWindow(QMainWindow):
         self.right_layout.insertWidget(8, apply_transformation_button)
 
     def hide_transformation_layout(self):
+        if self.right_layout.layout().count() < 6:  # never shown
+            return
         items_to_remove = []
         for index in range(9, 3, -1):
             items_to_remove.append(self.right_layout.takeAt(index))
@@ -194,18 +322,28 @@ class MainWindow(QMainWindow):
         self.right_layout.addStretch()
 
     def apply_transformation(self, x_rot_spin, y_rot_spin, z_rot_spin, x_trans_spin, y_trans_spin, z_trans_spin):
-        self.mesh_viewer.rotate_char([1, 0, 0], x_rot_spin.value())
-        self.mesh_viewer.rotate_char([0, 1, 0], y_rot_spin.value())
-        self.mesh_viewer.rotate_char([0, 0, 1], z_rot_spin.value())
-        self.mesh_viewer.translate_char([1, 0, 0], x_trans_spin.value())
-        self.mesh_viewer.translate_char([0, 1, 0], y_trans_spin.value())
-        self.mesh_viewer.translate_char([0, 0, 1], z_trans_spin.value())
+        self.mesh_viewer.transform_char([x_rot_spin.value(), y_rot_spin.value(), z_rot_spin.value()],
+                                        [x_trans_spin.value(), y_trans_spin.value(), z_trans_spin.value()])
 
 
 def main():
+    profile_startup = "--profile-startup" in sys.argv
+    if profile_startup:
+        sys.argv.remove("--profile-startup")
     app = QApplication(sys.argv)
+    mark_startup("QApplication")
     window = MainWindow()
+    mark_startup("window build")
     window.show()
+    mark_startup("show")
+
+    def first_paint():
+        window.mesh_viewer.frameSwapped.disconnect(first_paint)
+        mark_startup("first paint")
+        if profile_startup:
+            print_startup_profile()
+
+    window.mesh_viewer.frameSwapped.connect(first_paint)
     sys.exit(app.exec())
 
 
@@ -0,0 +1,116 @@
+import argparse
+import json
+import sys
+import time
+
+start_time = time.perf_counter()
+
+from Geometry import PATCH_ANGLE, TEXT_MARGIN
+from GlyphCache import GlyphCache
+from Serializer import Serializer
+
+import_time = time.perf_counter() - start_time
+
+
+def mark(arguments):
+    # Places the text (or every serial number of the range) on the face and writes the marked parts. Only NumPy,
+    # numpy-stl and the geometry modules are imported: no Qt and no OpenGL.
+    timings = {"import": import_time}
+    start = time.perf_counter()
+    glyph_cache = GlyphCache(preload=arguments.first is not None)
+    timings["glyphs"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if arguments.face is not None:
+        serializer = Serializer(arguments.input, arguments.text, face=arguments.face, glyph_cache=glyph_cache,
+                                number_width=arguments.number_width,
+                                patch_angle=None if arguments.single_triangle else arguments.patch_angle,
+                                fit=not arguments.no_fit, margin=arguments.margin)
+    else:
+        serializer = Serializer(arguments.input, arguments.text, point=arguments.point, normal=arguments.normal,
+                                glyph_cache=glyph_cache, number_width=arguments.number_width)
+    timings["load"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if arguments.first is None:
+        stats = serializer.write(arguments.text, arguments.output)
+        outputs = [{"path": stats["path"], "triangles": stats["triangles"], "bytes": stats["bytes"]}]
+    else:
+        last = arguments.first if arguments.last is None else arguments.last
+        if arguments.workers == 1:
+            file_names = serializer.export_range(arguments.first, last, arguments.output)
+        else:
+            file_names = serializer.export_range_parallel(arguments.first, last, arguments.output,
+                                                          workers=arguments.workers)
+        outputs = [{"path": file_name} for file_name in file_names]
+    timings["mark"] = time.perf_counter() - start
+    timings["total"] = time.perf_counter() - start_time
+
+    return {"status": "ok",
+            "command": "mark",
+            "input": arguments.input,
+            "base_triangles": len(serializer.base),
+            "face": arguments.face,
+            "point": [float(value) for value in serializer.center],
+            "normal": [float(value) for value in serializer.normal],
+            "patch": None if serializer.patch is None else {"faces": len(serializer.patch["faces"]),
+                                                            "area": serializer.patch["area"]},
+            "parts": len(outputs),
+            "outputs": outputs,
+            "timings": timings}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless MeshCataloger. Prints its result as JSON on stdout.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    mark_parser = commands.add_parser("mark", help="place a text or a serial number range on a face of an STL")
+    mark_parser.add_argument("input", help="STL file to mark")
+    mark_parser.add_argument("output", help="output STL, or output directory when a serial range is given")
+    face_group = mark_parser.add_mutually_exclusive_group(required=True)
+    face_group.add_argument("--face", type=int, help="index of the face to mark, in file order")
+    face_group.add_argument("--point", type=float, nargs=3, metavar=("X", "Y", "Z"),
+                            help="point to mark, in the file's coordinates (requires --normal)")
+    mark_parser.add_argument("--normal", type=float, nargs=3, metavar=("X", "Y", "Z"))
+    mark_parser.add_argument("--patch-angle", type=float,
+                             help=f"normal tolerance, in degrees, of the flat region grown around --face "
+                                  f"(default: {PATCH_ANGLE})")
+    mark_parser.add_argument("--single-triangle", action="store_true",
+                             help="lay the text out on the --face triangle alone")
+    mark_parser.add_argument("--no-fit", action="store_true",
+                             help="size the text with the whole part instead of fitting it to the face")
+    mark_parser.add_argument("--margin", type=float,
+                             help=f"fraction of the face's extent left free on each side of fitted text "
+                                  f"(default: {TEXT_MARGIN})")
+    mark_parser.add_argument("--text", default="*", help="text to place, '*' is replaced by the serial number")
+    mark_parser.add_argument("--first", type=int, help="first serial number; one part is written per number")
+    mark_parser.add_argument("--last", type=int, help="last serial number, included (default: --first)")
+    mark_parser.add_argument("--number-width", type=int, default=0, help="pad serial numbers with zeros")
+    mark_parser.add_argument("--workers", type=int, help="processes used for a range (default: one per CPU)")
+    arguments = parser.parse_args(argv)
+
+    if arguments.point is not None and arguments.normal is None:
+        parser.error("--point requires --normal")
+    if arguments.point is not None:
+        # a point has no face to grow a patch from or to fit the text to
+        for option, value in (("--patch-angle", arguments.patch_angle), ("--margin", arguments.margin),
+                              ("--single-triangle", arguments.single_triangle), ("--no-fit", arguments.no_fit)):
+            if value not in (None, False):
+                parser.error(f"{option} requires --face")
+    if arguments.patch_angle is None:
+        arguments.patch_angle = PATCH_ANGLE
+    if arguments.margin is None:
+        arguments.margin = TEXT_MARGIN
+    if not 0 <= arguments.margin < 0.5:
+        parser.error("--margin must be at least 0 and less than 0.5")
+
+    try:
+        result = mark(arguments)
+    except Exception as error:  # reported as JSON like any other result, callers parse stdout
+        result = {"status": "error", "command": arguments.command, "error": f"{type(error).__name__}: {error}"}
+    print(json.dumps(result, indent=2))
+    return 0 if result["status"] == "ok" else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
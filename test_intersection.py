@@ -0,0 +1,100 @@
+import numpy as np
+
+from BVH import BVH
+from Geometry import closest_intersection, ray_triangle_intersection
+
+
+def random_triangles(count, seed=0):
+    # Small triangles scattered through a 20 mm cube, so that most rays cross several of them.
+    generator = np.random.default_rng(seed)
+    corners = generator.uniform(-10, 10, (count, 1, 3))
+    return corners + generator.uniform(-3, 3, (count, 3, 3))
+
+
+def random_rays(count, seed=1):
+    # Rays from outside the cube aimed at points inside it, plus a few along the axes, where the tree's slab test
+    # divides by zero.
+    generator = np.random.default_rng(seed)
+    origins = generator.normal(size=(count, 3))
+    origins = origins / np.linalg.norm(origins, axis=1)[:, None] * 30
+    directions = generator.uniform(-8, 8, (count, 3)) - origins
+    axes = np.repeat(np.eye(3), 2, axis=0) * np.tile([1, -1], 3)[:, None]
+    axis_origins = generator.uniform(-6, 6, (6, 3)) - axes * 30
+    return np.concatenate((origins, axis_origins)), np.concatenate((directions, axes))
+
+
+def brute_force_hits(origin, direction, triangles):
+    # One triangle at a time: where the ray meets the triangle's plane, then whether that point is inside all three
+    # edges. Returns {face index: t}.
+    hits = {}
+    for face, (a, b, c) in enumerate(triangles):
+        normal = np.cross(b - a, c - a)
+        denominator = np.dot(normal, direction)
+        if abs(denominator) < 1e-12:
+            continue
+        t = np.dot(normal, a - origin) / denominator
+        if t <= 1e-6:
+            continue
+        point = origin + t * direction
+        if all(np.dot(np.cross(end - start, point - start), normal) >= 0
+               for start, end in ((a, b), (b, c), (c, a))):
+            hits[face] = t
+    return hits
+
+
+def test_ray_triangle_intersection_matches_brute_force():
+    triangles = random_triangles(600)
+    origins, directions = random_rays(24)
+    hit_count = 0
+    for origin, direction in zip(origins, directions):
+        expected = brute_force_hits(origin, direction, triangles)
+        faces, t = ray_triangle_intersection(origin, direction, triangles)
+        assert sorted(faces) == sorted(expected)
+        np.testing.assert_allclose(t, [expected[face] for face in faces], rtol=1e-9)
+        hit_count += len(faces)
+    assert hit_count > 60  # the rays do cross triangles, the check is not comparing empty results
+
+
+def test_multiple_rays_match_single_rays():
+    triangles = random_triangles(600)
+    origins, directions = random_rays(24)
+    rays, faces, t = ray_triangle_intersection(origins, directions, triangles)
+    for ray, (origin, direction) in enumerate(zip(origins, directions)):
+        single_faces, single_t = ray_triangle_intersection(origin, direction, triangles)
+        np.testing.assert_array_equal(faces[rays == ray], single_faces)
+        np.testing.assert_array_equal(t[rays == ray], single_t)
+
+
+def test_closest_intersection_matches_brute_force():
+    triangles = random_triangles(600)
+    origins, directions = random_rays(24)
+    for origin, direction in zip(origins, directions):
+        expected = brute_force_hits(origin, direction, triangles)
+        face, t = closest_intersection(origin, direction, triangles)
+        if not expected:
+            assert face is None and t == np.inf
+            continue
+        closest = min(expected, key=expected.get)
+        assert face == closest
+        assert np.isclose(t, expected[closest], rtol=1e-9)
+
+    face, t = closest_intersection([0, 0, 30], [0, 0, 1], triangles)  # pointing away from every triangle
+    assert face is None and t == np.inf
+
+
+def test_bvh_candidates_contain_every_hit():
+    triangles = random_triangles(600)
+    bvh = BVH(triangles, leaf_size=4)
+    origins, directions = random_rays(24)
+    for origin, direction in zip(origins, directions):
+        expected = brute_force_hits(origin, direction, triangles)
+        candidates = bvh.intersect(origin, direction)
+        assert len(np.unique(candidates)) == len(candidates)
+        assert set(expected) <= set(candidates.tolist())
+        assert len(candidates) < len(triangles)
+        # Picking tests the candidates only, and must land on the same triangle as a test of the whole mesh.
+        face, t = closest_intersection(origin, direction, triangles[candidates])
+        if expected:
+            assert candidates[face] == min(expected, key=expected.get)
+        else:
+            assert face is None